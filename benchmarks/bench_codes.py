@@ -0,0 +1,108 @@
+"""
+Group create latency: allocated codes vs random codes with retries.
+
+    python benchmarks/bench_codes.py [--creates 500] [--occupancy 0.5,0.9,0.99]
+
+Inserts --creates groups through database.create_group (against
+DATABASE_URL) and reports its latency, then times an INSERT that fails on
+the group_code unique index, which is what each retry of the old random
+scheme cost. Filling a real table to high occupancy of the 36^6 code space
+isn't practical, so the old scheme is priced from those two measurements:
+at occupancy f a random code collides with probability f, so a create takes
+about 1 / (1 - f) attempts (capped at 5) and fails outright with
+probability f^5. The allocator never collides, whatever the occupancy.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database as db
+import group_codes
+
+MAX_ATTEMPTS = 5
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+async def time_creates(n: int) -> list[float]:
+    times = []
+    for i in range(n):
+        start = time.perf_counter()
+        await db.create_group(f"bench {i}", "m0", "bench", "00:00")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def time_collisions(code: str, n: int) -> list[float]:
+    times = []
+    async with db.pool.acquire() as conn:
+        for _ in range(n):
+            start = time.perf_counter()
+            try:
+                await conn.execute(
+                    """INSERT INTO groups (group_id, group_code, group_name, daily_goal)
+                       VALUES (gen_random_uuid()::text, $1, 'bench', 'bench')""",
+                    code,
+                )
+            except asyncpg.UniqueViolationError:
+                pass
+            times.append(time.perf_counter() - start)
+    return times
+
+
+async def run(args) -> dict:
+    await db.init_pool()
+    try:
+        start = time.perf_counter()
+        for i in range(10_000):
+            group_codes.code_for(db._code_key, i)
+        allocate_us = (time.perf_counter() - start) / 10_000 * 1e6
+
+        creates = await time_creates(args.creates)
+        async with db.pool.acquire() as conn:
+            taken = await conn.fetchval("SELECT group_code FROM groups LIMIT 1")
+        collisions = await time_collisions(taken, args.creates)
+    finally:
+        await db.close_pool()
+
+    create = statistics.median(creates)
+    retry = statistics.median(collisions)
+    old = {}
+    for f in args.occupancy:
+        attempts = sum(f ** k for k in range(MAX_ATTEMPTS))
+        old[str(f)] = {
+            "expected_attempts": round(attempts, 2),
+            "expected_create_ms": _ms(create + (attempts - 1) * retry),
+            "failure_rate": f ** MAX_ATTEMPTS,
+        }
+    return {
+        "allocate_code_us": round(allocate_us, 2),
+        "create_p50_ms": _ms(create),
+        "create_p99_ms": _ms(sorted(creates)[int(len(creates) * 0.99)]),
+        "collision_roundtrip_p50_ms": _ms(retry),
+        "allocator_at_any_occupancy": {"expected_attempts": 1, "failure_rate": 0},
+        "random_codes_by_occupancy": old,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--creates", type=int, default=500)
+    parser.add_argument("--occupancy", default="0.5,0.9,0.99", help="table fill fractions to price the old scheme at")
+    args = parser.parse_args()
+    args.occupancy = [float(f) for f in args.occupancy.split(",")]
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
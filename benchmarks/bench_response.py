@@ -0,0 +1,122 @@
+"""
+Per-request CPU of turning a groups row into a response body.
+
+    python benchmarks/bench_response.py [--iterations 20000]
+
+"before" replays the old path: jsonb columns arrive as text and are
+json.loads-ed, a GroupResponse is built, then FastAPI validates and encodes
+it again for response_model. "after" is the current path: the connection
+codec decodes jsonb once and database.row_to_group's dict is serialized
+directly with database.dumps.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cache
+import database as db
+from game_logic import CityMap
+from models import CurrentBuild, GroupResponse, PendingEvent
+
+CITY = {
+    "0": ["house", None, "apartment", None, None],
+    "1": [None, "rubble", None, "skyscraper", None],
+    "2": ["house", "house", None, None, "rubble"],
+    "3": [None, None, "apartment", None, None],
+}
+BUILD = {"type": "apartment", "days_required": 3, "days_completed": 1}
+EVENT = {
+    "event_id": "evt_0123456789ab",
+    "type": "asteroid",
+    "tiles_destroyed": [[1, 1], [2, 4]],
+    "timestamp": "2026-02-25T08:00:00+00:00",
+}
+
+
+def _row(**columns) -> dict:
+    return {
+        "group_id": str(uuid.uuid4()),
+        "group_code": "ABC123",
+        "group_name": "Morning Runners",
+        "group_members": ["alice", "bob", "carol", "dave"],
+        "daily_goal": "Run 1 mile",
+        "goal_reset_time": "00:00",
+        "completions_today": ["alice", "bob"],
+        "streak": 1,
+        "last_processed_date": "2026-02-25",
+        "created_at": datetime.now(timezone.utc),
+        "version": 1,
+        "next_reset_at": datetime.now(timezone.utc),
+        **columns,
+    }
+
+
+def before(row: dict) -> bytes:
+    current_build = CurrentBuild(**json.loads(row["current_build"]))
+    pending_event = PendingEvent(**json.loads(row["pending_event"]))
+    resp = GroupResponse(
+        group_id=row["group_id"],
+        group_code=row["group_code"],
+        group_name=row["group_name"],
+        group_members=list(row["group_members"]),
+        daily_goal=row["daily_goal"],
+        goal_reset_time=row["goal_reset_time"],
+        completions_today=list(row["completions_today"]),
+        streak=row["streak"],
+        current_build=current_build,
+        city_map=json.loads(row["city_map"]),
+        last_processed_date=row["last_processed_date"],
+        pending_event=pending_event,
+        created_at=row["created_at"].isoformat(),
+    )
+    # What FastAPI did with the returned model for response_model
+    validated = GroupResponse.model_validate(resp.model_dump())
+    return json.dumps(validated.model_dump(mode="json")).encode()
+
+
+def after(row: dict) -> bytes:
+    decoded = {
+        **row,
+        "current_build": db.loads(row["current_build"][1:]),
+        "pending_event": db.loads(row["pending_event"][1:]),
+    }
+    return db.dumps(db.row_to_group(decoded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    # Measure the uncached build; the cache only helps on repeat reads
+    cache.CACHE_SIZE = 0
+
+    text_row = _row(current_build=json.dumps(BUILD), pending_event=json.dumps(EVENT), city_map=json.dumps(CITY))
+    binary_row = _row(
+        current_build=b"\x01" + db.dumps(BUILD),
+        pending_event=b"\x01" + db.dumps(EVENT),
+        city_bits=CityMap.from_json(CITY).to_bytes(),
+        grid_rows=4,
+        grid_cols=5,
+    )
+    assert json.loads(before(text_row))["city_map"] == json.loads(after(binary_row))["city_map"]
+
+    results = {}
+    for name, fn, row in (("before", before, text_row), ("after", after, binary_row)):
+        seconds = min(timeit.repeat(lambda: fn(row), number=args.iterations, repeat=5))
+        results[name] = {"us_per_request": round(seconds / args.iterations * 1e6, 2)}
+    results["saved_us_per_request"] = round(
+        results["before"]["us_per_request"] - results["after"]["us_per_request"], 2
+    )
+    results["orjson"] = db.orjson is not None
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
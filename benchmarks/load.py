@@ -0,0 +1,234 @@
+"""
+End-to-end load driver for the API.
+
+Serves main.app with uvicorn in this process (against DATABASE_URL, or with
+STORAGE_BACKEND=memory against nothing), seeds groups through the API, then
+runs:
+
+  mixed  - concurrent clients issuing a weighted mix of get / complete /
+           select_build / join / create, with feed sockets open on the
+           seeded groups, measuring per-endpoint latency and feed push delay
+  herd   - every seeded group made due at once, then one GET per group
+           fired together, like the first requests after a shared reset
+
+and prints (or writes) JSON with throughput and p50/p95/p99 per endpoint.
+
+    python benchmarks/load.py --groups 200 --clients 50 --sockets 200 --duration 20 --output run.json
+    python benchmarks/load.py ... --baseline run.json   # adds deltas against an earlier run
+
+The driver shares the server's event loop, so absolute latencies are
+pessimistic; the numbers are meant for comparing runs with each other.
+Needs httpx and websockets (uvicorn[standard] brings the latter).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import uvicorn
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main
+from storage import backend as db
+
+# Relative weights of the mixed workload
+MIX = {"get": 60, "complete": 25, "select_build": 8, "join": 5, "create": 2}
+BUILDINGS = ["house", "apartment", "skyscraper"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def add(self, name: str, seconds: float, ok: bool = True):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        out = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            out[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "per_second": round(len(values) / elapsed, 1),
+                "p50_ms": _percentile_ms(values, 50),
+                "p95_ms": _percentile_ms(values, 95),
+                "p99_ms": _percentile_ms(values, 99),
+            }
+        return out
+
+
+def _percentile_ms(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, round(p / 100 * (len(values) - 1)))
+    return round(values[index] * 1000, 2)
+
+
+async def _timed(rec: Recorder, name: str, request) -> httpx.Response | None:
+    start = time.perf_counter()
+    try:
+        resp = await request
+    except httpx.HTTPError:
+        rec.add(name, time.perf_counter() - start, ok=False)
+        return None
+    # 400s are expected game outcomes (full group, build in progress)
+    rec.add(name, time.perf_counter() - start, ok=resp.status_code < 500)
+    return resp
+
+
+async def seed(client: httpx.AsyncClient, n: int) -> list[dict]:
+    groups = []
+    for i in range(n):
+        resp = await client.post("/groups", json={
+            "group_name": f"bench {i}", "member": "m0", "daily_goal": "bench",
+        })
+        group = resp.json()
+        for m in range(1, random.randint(1, 4)):
+            resp = await client.post("/groups/join", json={"group_code": group["group_code"], "member": f"m{m}"})
+        groups.append(resp.json())
+    return groups
+
+
+async def _client_loop(client: httpx.AsyncClient, groups: list[dict], rec: Recorder, deadline: float, touched: dict):
+    names, weights = zip(*MIX.items())
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        group = random.choice(groups)
+        gid = group["group_id"]
+        member = random.choice(group["group_members"])
+        if name == "get":
+            await _timed(rec, name, client.get(f"/groups/{gid}"))
+        elif name == "complete":
+            touched[gid] = time.perf_counter()
+            await _timed(rec, name, client.post(f"/groups/{gid}/complete", json={"member": member}))
+        elif name == "select_build":
+            touched[gid] = time.perf_counter()
+            await _timed(rec, name, client.post(
+                f"/groups/{gid}/select_build", json={"member": member, "type": random.choice(BUILDINGS)},
+            ))
+        elif name == "join":
+            await _timed(rec, name, client.post("/groups/join", json={"group_code": group["group_code"], "member": member}))
+        else:
+            await _timed(rec, name, client.post("/groups", json={
+                "group_name": "bench new", "member": "m0", "daily_goal": "bench",
+            }))
+
+
+async def _socket_loop(ws_url: str, gid: str, rec: Recorder, deadline: float, touched: dict):
+    try:
+        async with websockets.connect(f"{ws_url}/groups/{gid}/feed") as ws:
+            rec.add("feed_connect", 0.0)
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(ws.recv(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return
+                sent = touched.pop(gid, None)
+                if sent is not None:
+                    rec.add("feed_push", time.perf_counter() - sent)
+    except (OSError, websockets.WebSocketException):
+        rec.add("feed_connect", 0.0, ok=False)
+
+
+async def run_mixed(client: httpx.AsyncClient, ws_url: str, groups: list[dict], args) -> dict:
+    rec = Recorder()
+    touched: dict[str, float] = {}
+    deadline = time.perf_counter() + args.duration
+    sockets = [
+        _socket_loop(ws_url, random.choice(groups)["group_id"], rec, deadline, touched)
+        for _ in range(args.sockets)
+    ]
+    clients = [_client_loop(client, groups, rec, deadline, touched) for _ in range(args.clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*sockets, *clients)
+    return rec.summary(time.perf_counter() - start)
+
+
+async def run_herd(client: httpx.AsyncClient, groups: list[dict]) -> dict:
+    rec = Recorder()
+    await db.make_due([g["group_id"] for g in groups])
+    start = time.perf_counter()
+    await asyncio.gather(*(_timed(rec, "get", client.get(f"/groups/{g['group_id']}")) for g in groups))
+    elapsed = time.perf_counter() - start
+    summary = rec.summary(elapsed)
+    summary["wall_ms"] = round(elapsed * 1000, 2)
+    return summary
+
+
+def _compare(current: dict, baseline: dict) -> dict:
+    """p95 and throughput change per scenario/endpoint, as percentages."""
+    deltas = {}
+    for scenario, endpoints in current.items():
+        for name, stats in endpoints.items():
+            before = baseline.get(scenario, {}).get(name)
+            if not isinstance(stats, dict) or not before:
+                continue
+            deltas[f"{scenario}.{name}"] = {
+                key: round((stats[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+                for key in ("p95_ms", "per_second")
+            }
+    return deltas
+
+
+async def run(args) -> dict:
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            groups = await seed(client, args.groups)
+            results = {"mixed": await run_mixed(client, base_url.replace("http", "ws"), groups, args)}
+            results["herd"] = await run_herd(client, groups)
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=50, help="concurrent HTTP clients")
+    parser.add_argument("--sockets", type=int, default=200, help="concurrent feed websockets")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of mixed load")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    results["params"] = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["vs_baseline"] = _compare(results, json.load(f))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,274 @@
+"""
+Bulk load and export of groups, for seeding staging and moving production data.
+
+    python bulk.py export > groups.ndjson
+    python bulk.py load < groups.ndjson
+    python bulk.py generate --groups 1000000 --seed 1 | python bulk.py load
+
+One group per line, as JSON:
+
+    {"group_id": ..., "group_code": ..., "group_name": ..., "group_members": [...],
+     "daily_goal": ..., "goal_reset_time": "HH:MM", "completions_today": [...],
+     "streak": 0, "current_build": {...} or null, "city_map": {"0": [...], ...},
+     "last_processed_date": "YYYY-MM-DD" or null, "pending_event": {...} or null,
+     "created_at": ISO 8601, "next_reset_at": ISO 8601, "last_active_at": ISO 8601,
+     "best_streak": 0, "total_days_completed": 0, "version": 0,
+     "events": [{"seq": 1, "event": {...}, "created_at": ISO 8601}, ...]}
+
+export writes every column that can't be derived, streaming groups and then
+groups_archive through server-side cursors, so memory stays at one --batch
+of rows. load takes the same lines in batches of --batch and writes each
+with COPY; only group_name and daily_goal are required. Missing ids get a
+fresh uuid and missing codes come from the code allocator, so generated and
+exported data load the same way. Each group's event log travels with it, seq
+and all, and load moves the group_events sequence past the highest seq it
+wrote, so clients' ?after= cursors keep working on the new database. An
+existing group_id, group_code or event seq fails that batch (and the load),
+so load into an empty table or one that doesn't share the data's groups.
+generate writes synthetic groups in this format, with random but valid
+cities, builds and completions. Runs against DATABASE_URL.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+import database as db
+from game_logic import (
+    BUILDING_DAYS, GRID_COLS, GRID_ROWS, MAX_MEMBERS, CityMap,
+    get_processing_date, next_reset_at,
+)
+
+# Column order of the records handed to COPY
+COLUMNS = (
+    "group_id", "group_code", "group_name", "group_members", "daily_goal", "goal_reset_time",
+    "completions_today", "streak", "current_build", "city_bits", "grid_rows", "grid_cols",
+    "free_tiles", "last_processed_date", "pending_event", "created_at", "version", "next_reset_at",
+    "last_active_at", "houses", "apartments", "skyscrapers", "rubble", "best_streak",
+    "total_days_completed",
+)
+
+# generate: how a non-empty tile is filled
+TILE_MIX = {"house": 5, "apartment": 3, "skyscraper": 1, "rubble": 1}
+
+
+def _timestamp(value: str | None, default: datetime) -> datetime:
+    return datetime.fromisoformat(value) if value else default
+
+
+def to_record(group: dict, group_code: str | None, now: datetime) -> tuple:
+    """A line of NDJSON as a groups row, in COLUMNS order."""
+    city = CityMap.from_json(group["city_map"]) if group.get("city_map") else CityMap()
+    goal_reset_time = group.get("goal_reset_time") or "00:00"
+    last_processed_date = group.get("last_processed_date")
+    if last_processed_date:
+        due = next_reset_at(goal_reset_time, last_processed_date)
+    else:
+        due = now
+    city_counts = db.city_columns(city)
+    return (
+        group.get("group_id") or str(uuid.uuid4()),
+        group_code or group["group_code"].upper(),
+        group["group_name"],
+        group.get("group_members") or [],
+        group["daily_goal"],
+        goal_reset_time,
+        group.get("completions_today") or [],
+        group.get("streak", 0),
+        group.get("current_build"),
+        city.to_bytes(),
+        city.rows,
+        city.cols,
+        city_counts["free_tiles"],
+        last_processed_date,
+        group.get("pending_event"),
+        _timestamp(group.get("created_at"), now),
+        group.get("version", 0),
+        _timestamp(group.get("next_reset_at"), due),
+        _timestamp(group.get("last_active_at"), now),
+        city_counts["houses"],
+        city_counts["apartments"],
+        city_counts["skyscrapers"],
+        city_counts["rubble"],
+        group.get("best_streak", group.get("streak", 0)),
+        group.get("total_days_completed", 0),
+    )
+
+
+def to_event_records(group: dict, group_id: str) -> list[tuple]:
+    """A line's events as group_events rows, in db._EVENT_COLUMNS order."""
+    return [
+        (e["seq"], group_id, e["event"], datetime.fromisoformat(e["created_at"]))
+        for e in group.get("events") or ()
+    ]
+
+
+def to_line(row, events) -> bytes:
+    """A groups row and its (seq, event, created_at) events, oldest first, as a line of NDJSON."""
+    return db.dumps({
+        "group_id": row["group_id"],
+        "group_code": row["group_code"],
+        "group_name": row["group_name"],
+        "group_members": list(row["group_members"]),
+        "daily_goal": row["daily_goal"],
+        "goal_reset_time": row["goal_reset_time"],
+        "completions_today": list(row["completions_today"]),
+        "streak": row["streak"],
+        "current_build": row["current_build"],
+        "city_map": db.city_of(row).to_json(),
+        "last_processed_date": row["last_processed_date"],
+        "pending_event": row["pending_event"],
+        "created_at": row["created_at"].isoformat(),
+        "next_reset_at": row["next_reset_at"].isoformat(),
+        "last_active_at": row["last_active_at"].isoformat(),
+        "best_streak": row["best_streak"],
+        "total_days_completed": row["total_days_completed"],
+        "version": row["version"],
+        "events": [{"seq": seq, "event": event, "created_at": at.isoformat()} for seq, event, at in events],
+    }) + b"\n"
+
+
+async def export(out, batch: int) -> int:
+    n = 0
+    async with db.pool.acquire() as conn:
+        # Cursors only live inside a transaction
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            live = """SELECT g.*, ARRAY(
+                          SELECT (e.seq, e.event, e.created_at) FROM group_events e
+                          WHERE e.group_id = g.group_id ORDER BY e.seq
+                      ) AS events
+                      FROM groups g"""
+            async for row in conn.cursor(live, prefetch=batch):
+                out.write(to_line(row, row["events"]))
+                n += 1
+            # Archived groups load back as hot ones, idle since they were archived
+            async for archived in conn.cursor("SELECT * FROM groups_archive", prefetch=batch):
+                row, events = db._unarchived(archived)
+                out.write(to_line(
+                    {**row, "last_active_at": archived["archived_at"]},
+                    [(seq, event, at) for seq, _, event, at in events],
+                ))
+                n += 1
+    out.flush()
+    return n
+
+
+async def _copy(groups: list[dict]) -> int:
+    now = datetime.now(timezone.utc)
+    async with db.pool.acquire() as conn:
+        codes = await db.allocate_group_codes(conn, sum(not g.get("group_code") for g in groups))
+        records = [to_record(g, None if g.get("group_code") else codes.pop(), now) for g in groups]
+        events = [event for g, record in zip(groups, records) for event in to_event_records(g, record[0])]
+        async with conn.transaction():
+            await conn.copy_records_to_table("groups", records=records, columns=COLUMNS)
+            if events:
+                await conn.copy_records_to_table("group_events", records=events, columns=db._EVENT_COLUMNS)
+                # New events must number after the loaded ones
+                await conn.execute(
+                    """SELECT setval('group_events_seq_seq', GREATEST($1, last_value)) FROM group_events_seq_seq""",
+                    max(seq for seq, *_ in events),
+                )
+    return len(records)
+
+
+async def load(lines, batch: int) -> int:
+    n = 0
+    start = time.perf_counter()
+    groups = []
+    for line in lines:
+        if line.strip():
+            groups.append(db.loads(line))
+        if len(groups) == batch:
+            n += await _copy(groups)
+            groups = []
+            print(f"loaded {n} ({n / (time.perf_counter() - start):,.0f}/s)", file=sys.stderr)
+    if groups:
+        n += await _copy(groups)
+    return n
+
+
+def random_group(rng: random.Random, i: int, rows: int, cols: int) -> dict:
+    """A valid group mid-game: some buildings and rubble, maybe a build underway."""
+    members = [f"member-{i}-{k}" for k in range(rng.randint(1, MAX_MEMBERS))]
+    goal_reset_time = f"{rng.randrange(24):02d}:00"
+
+    city = CityMap(0, rows, cols)
+    kinds, weights = list(TILE_MIX), list(TILE_MIX.values())
+    filled = rng.random()
+    for r in range(rows):
+        for c in range(cols):
+            if rng.random() < filled:
+                city = city.with_tile(r, c, rng.choices(kinds, weights)[0])
+
+    current_build = None
+    if city.has_empty() and rng.random() < 0.7:
+        kind = rng.choice(list(BUILDING_DAYS))
+        current_build = {
+            "type": kind,
+            "days_required": BUILDING_DAYS[kind],
+            "days_completed": rng.randrange(BUILDING_DAYS[kind]),
+        }
+
+    return {
+        "group_name": f"Group {i}",
+        "group_members": members,
+        "daily_goal": rng.choice(["run", "read", "stretch", "meditate", "write"]),
+        "goal_reset_time": goal_reset_time,
+        "completions_today": [m for m in members if rng.random() < 0.5],
+        # The streak counts the days of the build underway
+        "streak": current_build["days_completed"] if current_build else 0,
+        "current_build": current_build,
+        "city_map": city.to_json(),
+        "last_processed_date": get_processing_date(goal_reset_time),
+    }
+
+
+def generate(out, n: int, seed: int, rows: int, cols: int):
+    rng = random.Random(seed)
+    for i in range(n):
+        out.write(db.dumps(random_group(rng, i, rows, cols)) + b"\n")
+    out.flush()
+
+
+async def _with_pool(work):
+    await db.init_pool()
+    try:
+        return await work
+    finally:
+        await db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = commands.add_parser("export", help="write every group to stdout")
+    export_cmd.add_argument("--batch", type=int, default=5000, help="rows fetched per cursor round trip")
+    load_cmd = commands.add_parser("load", help="insert groups read from stdin")
+    load_cmd.add_argument("--batch", type=int, default=10_000, help="rows per COPY")
+    generate_cmd = commands.add_parser("generate", help="write synthetic groups to stdout")
+    generate_cmd.add_argument("--groups", type=int, default=1000)
+    generate_cmd.add_argument("--seed", type=int, default=0)
+    generate_cmd.add_argument("--rows", type=int, default=GRID_ROWS)
+    generate_cmd.add_argument("--cols", type=int, default=GRID_COLS)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(sys.stdout.buffer, args.groups, args.seed, args.rows, args.cols)
+        return
+
+    load_dotenv()
+    start = time.perf_counter()
+    if args.command == "export":
+        n = asyncio.run(_with_pool(export(sys.stdout.buffer, args.batch)))
+    else:
+        n = asyncio.run(_with_pool(load(sys.stdin.buffer, args.batch)))
+    print(f"{args.command}: {n} groups in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
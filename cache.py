@@ -0,0 +1,113 @@
+import os
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get("GROUP_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("GROUP_CACHE_TTL_SECONDS", "60"))
+
+# group_id -> (expires_at, version, group), where group is the dict built by
+# database.row_to_group. A None group is a tombstone: a newer version exists
+# elsewhere, so older puts are ignored until it expires.
+_entries: OrderedDict[str, tuple[float, int, dict | None]] = OrderedDict()
+_codes: dict[str, str] = {}
+
+hits = 0
+misses = 0
+
+
+def _live(group_id: str) -> tuple[int, dict] | None:
+    entry = _entries.get(group_id)
+    if entry is None:
+        return None
+    expires_at, version, group = entry
+    if expires_at < time.monotonic():
+        _drop(group_id)
+        return None
+    if group is None:
+        return None
+    _entries.move_to_end(group_id)
+    return version, group
+
+
+def _drop(group_id: str):
+    entry = _entries.pop(group_id, None)
+    if entry is not None and entry[2] is not None:
+        _codes.pop(entry[2]["group_code"], None)
+
+
+def get(group_id: str) -> dict | None:
+    live = get_versioned(group_id)
+    return live[1] if live else None
+
+
+def get_versioned(group_id: str) -> tuple[int, dict] | None:
+    global hits, misses
+    live = _live(group_id)
+    if live is None:
+        misses += 1
+        return None
+    hits += 1
+    return live
+
+
+def version(group_id: str) -> int | None:
+    """Version of the cached group, if any. Not counted as a hit or miss."""
+    live = _live(group_id)
+    return live[0] if live else None
+
+
+def get_by_code(group_code: str) -> dict | None:
+    global misses
+    group_id = _codes.get(group_code.upper())
+    if group_id is None:
+        misses += 1
+        return None
+    return get(group_id)
+
+
+def lookup(group_id: str, version: int) -> dict | None:
+    """The cached group if it is exactly this version. Not counted as a hit or miss."""
+    live = _live(group_id)
+    if live is None or live[0] != version:
+        return None
+    return live[1]
+
+
+def put(group: dict, version: int, max_age: float = CACHE_TTL_SECONDS):
+    """Cache a group for at most max_age seconds, e.g. until its day is due."""
+    group_id = group["group_id"]
+    entry = _entries.get(group_id)
+    if entry is not None and entry[1] > version:
+        return
+    _drop(group_id)
+    if max_age <= 0:
+        return
+    _entries[group_id] = (time.monotonic() + min(max_age, CACHE_TTL_SECONDS), version, group)
+    _codes[group["group_code"]] = group_id
+    while len(_entries) > CACHE_SIZE:
+        _drop(next(iter(_entries)))
+
+
+def invalidate(group_id: str, version: int | None = None):
+    """
+    Forget a group. With a version (from a change notification), keep the
+    entry if it is already that new, otherwise leave a tombstone so a read
+    that raced the change can't re-cache the older row.
+    """
+    entry = _entries.get(group_id)
+    if version is None:
+        _drop(group_id)
+        return
+    if entry is not None and entry[1] >= version:
+        return
+    _drop(group_id)
+    _entries[group_id] = (time.monotonic() + CACHE_TTL_SECONDS, version, None)
+
+
+def clear():
+    _entries.clear()
+    _codes.clear()
+
+
+def stats() -> dict:
+    return {"size": len(_entries), "hits": hits, "misses": misses}
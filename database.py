@@ -1,13 +1,49 @@
 import os
 import json
+import asyncio
+import functools
+import secrets
 import uuid
-import random
-import string
+import time
+import zlib
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 import asyncpg
-from models import GroupResponse, CurrentBuild, PendingEvent
+import cache
+import group_codes
+import metrics
+from game_logic import CityMap, GRID_COLS, GRID_ROWS
+from models import PendingEvent
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json does the same job, slower
+    orjson = None
 
 pool: asyncpg.Pool | None = None
 
+# Opt-in: gather add_completion calls for a few ms and write them as one
+# statement, trading that much latency for fewer pool round trips at peaks
+COALESCE_COMPLETIONS = os.environ.get("COALESCE_COMPLETIONS", "") == "1"
+COALESCE_WINDOW_SECONDS = float(os.environ.get("COALESCE_WINDOW_MS", "3")) / 1000
+COALESCE_MAX_BATCH = 256
+
+_pending_completions: list[tuple[str, str, asyncio.Future]] = []
+_flushes: set[asyncio.Task] = set()
+
+_code_key = b""
+_code_block = range(0)
+
+if orjson is not None:
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    def dumps(val) -> bytes:
+        return json.dumps(val, separators=(",", ":")).encode()
+
+    loads = json.loads
+
 CREATE_TABLE = """
 CREATE TABLE IF NOT EXISTS groups (
     group_id     TEXT PRIMARY KEY,
@@ -19,25 +55,432 @@ CREATE TABLE IF NOT EXISTS groups (
     completions_today TEXT[] NOT NULL DEFAULT '{}',
     streak       INTEGER NOT NULL DEFAULT 0,
     current_build JSONB,
-    city_map     JSONB NOT NULL,
+    city_bits    BYTEA NOT NULL DEFAULT ''::bytea,
+    grid_rows    SMALLINT NOT NULL DEFAULT 4,
+    grid_cols    SMALLINT NOT NULL DEFAULT 5,
+    free_tiles   INTEGER NOT NULL DEFAULT 20,
     last_processed_date TEXT,
     pending_event JSONB,
-    created_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    version      BIGINT NOT NULL DEFAULT 0,
+    next_reset_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_active_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    houses       INTEGER NOT NULL DEFAULT 0,
+    apartments   INTEGER NOT NULL DEFAULT 0,
+    skyscrapers  INTEGER NOT NULL DEFAULT 0,
+    rubble       INTEGER NOT NULL DEFAULT 0,
+    buildings    INTEGER GENERATED ALWAYS AS (houses + apartments + skyscrapers) STORED,
+    best_streak  INTEGER NOT NULL DEFAULT 0,
+    total_days_completed INTEGER NOT NULL DEFAULT 0
+);
+
+-- Append-only log of every event a group has produced; seq is the client cursor
+CREATE TABLE IF NOT EXISTS group_events (
+    seq        BIGSERIAL PRIMARY KEY,
+    group_id   TEXT NOT NULL REFERENCES groups (group_id) ON DELETE CASCADE,
+    event      JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS group_events_group_seq_idx ON group_events (group_id, seq);
+
+-- Groups nobody acted on for a while, moved out of groups by archive_inactive
+-- and back on first lookup. data is the rest of the row and its events,
+-- compressed (see _pack_archived); group_members stays a column so member
+-- listings find them.
+CREATE TABLE IF NOT EXISTS groups_archive (
+    group_id      TEXT PRIMARY KEY,
+    group_code    TEXT UNIQUE NOT NULL,
+    group_members TEXT[] NOT NULL,
+    created_at    TIMESTAMPTZ NOT NULL,
+    archived_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    data          BYTEA NOT NULL
+);
+CREATE INDEX IF NOT EXISTS groups_archive_members_idx ON groups_archive USING gin (group_members);
+
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS city_bits BYTEA NOT NULL DEFAULT ''::bytea;
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS grid_rows SMALLINT NOT NULL DEFAULT 4;
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS grid_cols SMALLINT NOT NULL DEFAULT 5;
+-- Existing groups start their idle clock at the migration
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+DROP INDEX IF EXISTS groups_reset_bucket_idx;
+
+-- Every update bumps the row version, whichever statement made it
+CREATE OR REPLACE FUNCTION bump_group_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER groups_bump_version
+    BEFORE UPDATE ON groups
+    FOR EACH ROW EXECUTE FUNCTION bump_group_version();
+
+-- Every change is announced on group_changes as "group_id:version",
+-- or just "group_id" when the row was deleted
+CREATE OR REPLACE FUNCTION notify_group_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('group_changes', OLD.group_id);
+    ELSE
+        PERFORM pg_notify('group_changes', NEW.group_id || ':' || NEW.version);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER groups_notify_change
+    AFTER UPDATE OR DELETE ON groups
+    FOR EACH ROW EXECUTE FUNCTION notify_group_change();
+"""
+
+# Group code counters, handed out CODE_BLOCK_SIZE at a time (see group_codes.py),
+# and the permutation key, generated once per database
+CODE_BLOCK_SIZE = 100
+
+CREATE_CODE_ALLOCATOR = f"""
+CREATE SEQUENCE IF NOT EXISTS group_code_seq;
+ALTER SEQUENCE group_code_seq INCREMENT BY {CODE_BLOCK_SIZE};
+
+CREATE TABLE IF NOT EXISTS app_settings (
+    name  TEXT PRIMARY KEY,
+    value TEXT NOT NULL
 );
 """
 
-EMPTY_CITY = {str(i): [None]*5 for i in range(4)}
+# Indexes that reference columns added by migrations, created after them
+CREATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS groups_next_reset_at_idx ON groups (next_reset_at);
+CREATE INDEX IF NOT EXISTS groups_members_idx ON groups USING gin (group_members);
+CREATE INDEX IF NOT EXISTS groups_last_active_at_idx ON groups (last_active_at);
+-- Leaderboard top-K scans, one per RANKED_COLUMNS entry
+CREATE INDEX IF NOT EXISTS groups_buildings_rank_idx ON groups (buildings DESC, group_id);
+CREATE INDEX IF NOT EXISTS groups_best_streak_rank_idx ON groups (best_streak DESC, group_id);
+CREATE INDEX IF NOT EXISTS groups_total_days_completed_rank_idx ON groups (total_days_completed DESC, group_id);
+"""
+
+# True when the row's day has already been rolled over for the current period
+DAY_PROCESSED = "next_reset_at > now()"
+
+# Marks a member action. last_active_at is indexed, so it only moves once a
+# day; the rest of the time the value is unchanged and the update can stay HOT.
+TOUCH_ACTIVE = "last_active_at = GREATEST(last_active_at, date_trunc('day', now()))"
+
+# Conditional mutations return the updated row with applied = true, or the
+# unchanged row with applied = false when the guard didn't match, so callers
+# can tell why in the same round trip.
+_MUTATE_OR_FETCH = """
+WITH upd AS ({update} RETURNING *)
+SELECT upd.*, true AS applied FROM upd
+UNION ALL
+SELECT g.*, false AS applied FROM groups g
+WHERE g.{key} = $1 AND NOT EXISTS (SELECT 1 FROM upd)
+"""
+
+# Fixed write statements, run by name. Each pool connection executes them
+# once as it opens (against a key that matches no row) so asyncpg's
+# per-connection statement cache already holds them prepared. update_group
+# falls back to building SQL for column sets not listed here.
+STATEMENTS = {
+    # Append member to completions_today if they're a member, haven't
+    # completed, and the day is processed
+    "completion_append": _MUTATE_OR_FETCH.format(
+        key="group_id",
+        update=f"""UPDATE groups SET completions_today = array_append(completions_today, $2), {TOUCH_ACTIVE}
+                   WHERE group_id = $1
+                     AND $2 = ANY(group_members)
+                     AND NOT ($2 = ANY(completions_today))
+                     AND {DAY_PROCESSED}""",
+    ),
+    # Append member to group_members if absent and the group has room
+    "membership_add": _MUTATE_OR_FETCH.format(
+        key="group_code",
+        update=f"""UPDATE groups SET group_members = array_append(group_members, $2), {TOUCH_ACTIVE}
+                  WHERE group_code = $1
+                    AND NOT ($2 = ANY(group_members))
+                    AND cardinality(group_members) < $3""",
+    ),
+    # Set current_build if none is active, member belongs, the city has room,
+    # and the day is processed
+    "build_set": _MUTATE_OR_FETCH.format(
+        key="group_id",
+        update=f"""UPDATE groups SET current_build = $2::jsonb, {TOUCH_ACTIVE}
+                   WHERE group_id = $1
+                     AND current_build IS NULL
+                     AND $3 = ANY(group_members)
+                     AND free_tiles > 0
+                     AND {DAY_PROCESSED}""",
+    ),
+    # Full post-rollover state for any number of groups, skipping rows
+    # already processed for that date or written since they were read (a
+    # completion that landed after the read must not be wiped), and the
+    # events of the rows it wrote
+    "day_rollover": """
+        WITH rolled AS (
+        UPDATE groups AS g SET
+            completions_today = '{}',
+            streak = v.streak,
+            best_streak = GREATEST(g.best_streak, v.best_streak),
+            total_days_completed = g.total_days_completed + v.completed_days,
+            current_build = v.current_build,
+            city_bits = v.city_bits,
+            free_tiles = v.free_tiles,
+            houses = v.houses,
+            apartments = v.apartments,
+            skyscrapers = v.skyscrapers,
+            rubble = v.rubble,
+            pending_event = v.pending_event,
+            last_processed_date = v.last_processed_date,
+            next_reset_at = v.next_reset_at
+        FROM unnest(
+            $1::text[], $2::int[], $3::int[], $4::int[], $5::jsonb[], $6::bytea[], $7::int[],
+            $8::int[], $9::int[], $10::int[], $11::int[], $12::jsonb[], $13::text[], $14::timestamptz[],
+            $15::bigint[]
+        ) AS v(
+            group_id, streak, best_streak, completed_days, current_build, city_bits, free_tiles,
+            houses, apartments, skyscrapers, rubble, pending_event, last_processed_date, next_reset_at,
+            version
+        )
+        WHERE g.group_id = v.group_id
+          AND g.last_processed_date IS DISTINCT FROM v.last_processed_date
+          AND g.version = v.version
+        RETURNING g.*
+        ), logged AS (
+            INSERT INTO group_events (group_id, event)
+            SELECT e.group_id, e.event
+            FROM unnest($16::text[], $17::jsonb[]) WITH ORDINALITY AS e(group_id, event, n)
+            WHERE e.group_id IN (SELECT group_id FROM rolled)
+            ORDER BY e.n
+        )
+        SELECT * FROM rolled""",
+    # completion_append for many (group_id, member) pairs: each group's new
+    # completions land in one row update. One row per pair, in order;
+    # applied = the member is in completions_today for the current day. A row
+    # whose reset has passed is never applied: its completions are the old
+    # day's, and the caller has to roll it over and retry.
+    "completion_append_batch": f"""
+        WITH req AS (
+            SELECT group_id, member, n
+            FROM unnest($1::text[], $2::text[]) WITH ORDINALITY AS r(group_id, member, n)
+        ), by_group AS (
+            SELECT group_id, array_agg(member ORDER BY n) AS members FROM req GROUP BY group_id
+        ), upd AS (
+            UPDATE groups AS g
+            SET completions_today = g.completions_today || ARRAY(
+                SELECT m FROM unnest(b.members) WITH ORDINALITY AS x(m, i)
+                WHERE m = ANY(g.group_members) AND NOT (m = ANY(g.completions_today))
+                GROUP BY m ORDER BY min(i)
+            ), {TOUCH_ACTIVE}
+            FROM by_group b
+            WHERE g.group_id = b.group_id
+              AND EXISTS (
+                  SELECT 1 FROM unnest(b.members) AS m
+                  WHERE m = ANY(g.group_members) AND NOT (m = ANY(g.completions_today))
+              )
+              AND {DAY_PROCESSED}
+            RETURNING g.*
+        ), cur AS (
+            SELECT * FROM upd
+            UNION ALL
+            SELECT g.* FROM groups g
+            WHERE g.group_id IN (SELECT group_id FROM by_group)
+              AND NOT EXISTS (SELECT 1 FROM upd WHERE upd.group_id = g.group_id)
+        )
+        SELECT req.n, cur.*, req.member = ANY(cur.completions_today) AND cur.next_reset_at > now() AS applied
+        FROM req JOIN cur ON cur.group_id = req.group_id""",
+    "event_append": """
+        INSERT INTO group_events (group_id, event)
+        SELECT $1, e.event FROM unnest($2::jsonb[]) WITH ORDINALITY AS e(event, n)
+        ORDER BY e.n""",
+    "map_write": """UPDATE groups SET city_bits = $2, free_tiles = $3,
+                        houses = $4, apartments = $5, skyscrapers = $6, rubble = $7
+                    WHERE group_id = $1 RETURNING *""",
+}
+
+# Columns kept in step with city_bits by every write of a city (see city_columns)
+_TILE_COUNTERS = {"houses": "house", "apartments": "apartment", "skyscrapers": "skyscraper", "rubble": "rubble"}
+_CITY_COLUMNS = ("free_tiles", *_TILE_COUNTERS)
+
+# Leaderboard columns, each with a top-K index
+RANKED_COLUMNS = ("buildings", "best_streak", "total_days_completed")
+
+# Arguments that make each statement touch nothing, for warming
+_WARMUP_ARGS = {
+    "completion_append": ("", ""),
+    "membership_add": ("", "", 0),
+    "build_set": ("", None, ""),
+    "day_rollover": ([],) * 17,
+    "completion_append_batch": ([], []),
+    "event_append": ("", []),
+    "map_write": ("", b"", 0, 0, 0, 0, 0),
+}
+
+# update_group column sets that have a named statement, with its parameter order
+_UPDATE_STATEMENTS = {
+    frozenset({"city_map", *_CITY_COLUMNS}): ("map_write", ("city_map", *_CITY_COLUMNS)),
+}
+
+_named_counts = dict.fromkeys(STATEMENTS, 0)
+_dynamic_count = 0
+_dynamic_shapes: set[str] = set()
+
+
+def _encode_jsonb(val) -> bytes:
+    # Binary jsonb is a version byte followed by the JSON text
+    return b"\x01" + dumps(val)
+
+
+def _decode_jsonb(data: bytes):
+    return loads(data[1:])
+
+
+async def _init_codecs(conn: asyncpg.Connection):
+    """jsonb/json columns come back as Python objects and accept them as parameters."""
+    await conn.set_type_codec(
+        "jsonb", schema="pg_catalog", format="binary",
+        encoder=_encode_jsonb, decoder=_decode_jsonb,
+    )
+    await conn.set_type_codec(
+        "json", schema="pg_catalog", format="binary",
+        encoder=dumps, decoder=loads,
+    )
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    await _init_codecs(conn)
+    for name, sql in STATEMENTS.items():
+        await conn.fetch(sql, *_WARMUP_ARGS[name])
 
 
 async def init_pool():
     global pool
+    # Schema first: pool connections warm statements against it as they open
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await _init_codecs(conn)
+        await conn.execute(CREATE_TABLE)
+        await _migrate_city_bits(conn)
+        await _migrate_city_map(conn)
+        await _migrate_free_tiles(conn)
+        await _migrate_next_reset_at(conn)
+        await _migrate_counters(conn)
+        await conn.execute(CREATE_INDEXES)
+        await _load_code_key(conn)
+    finally:
+        await conn.close()
+
     pool = await asyncpg.create_pool(
         os.environ["DATABASE_URL"],
         min_size=1,
         max_size=5,
+        init=_init_connection,
     )
-    async with pool.acquire() as conn:
-        await conn.execute(CREATE_TABLE)
+
+
+async def _column_type(conn: asyncpg.Connection, column: str) -> str | None:
+    return await conn.fetchval(
+        """SELECT data_type FROM information_schema.columns
+           WHERE table_name = 'groups' AND column_name = $1""",
+        column,
+    )
+
+
+async def _has_column(conn: asyncpg.Connection, column: str) -> bool:
+    return await _column_type(conn, column) is not None
+
+
+async def _migrate_city_bits(conn: asyncpg.Connection):
+    """Widen city_bits from BIGINT to BYTEA, which fits grids of any size."""
+    if await _column_type(conn, "city_bits") != "bigint":
+        return
+    # int8send is the big-endian bytes CityMap.from_bytes expects
+    await conn.execute(
+        """ALTER TABLE groups
+               ALTER COLUMN city_bits DROP DEFAULT,
+               ALTER COLUMN city_bits TYPE BYTEA USING int8send(city_bits),
+               ALTER COLUMN city_bits SET DEFAULT ''::bytea"""
+    )
+
+
+async def _migrate_city_map(conn: asyncpg.Connection):
+    """Pack the legacy JSONB city_map column into city_bits, then drop it."""
+    if not await _has_column(conn, "city_map"):
+        return
+    async with conn.transaction():
+        rows = await conn.fetch("SELECT group_id, city_map FROM groups FOR UPDATE")
+        await conn.executemany(
+            "UPDATE groups SET city_bits = $2 WHERE group_id = $1",
+            [(r["group_id"], CityMap.from_json(r["city_map"]).to_bytes()) for r in rows],
+        )
+        await conn.execute("ALTER TABLE groups DROP COLUMN city_map")
+
+
+async def _migrate_free_tiles(conn: asyncpg.Connection):
+    """Add free_tiles, counted from each row's city."""
+    if await _has_column(conn, "free_tiles"):
+        return
+    async with conn.transaction():
+        await conn.execute("ALTER TABLE groups ADD COLUMN free_tiles INTEGER NOT NULL DEFAULT 20")
+        rows = await conn.fetch("SELECT group_id, city_bits, grid_rows, grid_cols FROM groups FOR UPDATE")
+        await conn.executemany(
+            "UPDATE groups SET free_tiles = $2 WHERE group_id = $1",
+            [(r["group_id"], city_of(r).free_count()) for r in rows],
+        )
+
+
+async def _migrate_next_reset_at(conn: asyncpg.Connection):
+    """Add next_reset_at, derived from each row's last processed period."""
+    if await _has_column(conn, "next_reset_at"):
+        return
+    async with conn.transaction():
+        await conn.execute(
+            "ALTER TABLE groups ADD COLUMN next_reset_at TIMESTAMPTZ NOT NULL DEFAULT now()"
+        )
+        await conn.execute(
+            """UPDATE groups
+               SET next_reset_at = (last_processed_date::date + 1 + goal_reset_time::interval) AT TIME ZONE 'UTC'
+               WHERE last_processed_date IS NOT NULL"""
+        )
+
+
+async def _migrate_counters(conn: asyncpg.Connection):
+    """
+    Add the leaderboard counters: tile counts from each row's city, best_streak
+    from its current streak. Days completed before now weren't recorded.
+    """
+    if await _has_column(conn, "houses"):
+        return
+    async with conn.transaction():
+        await conn.execute(
+            """ALTER TABLE groups
+                   ADD COLUMN houses INTEGER NOT NULL DEFAULT 0,
+                   ADD COLUMN apartments INTEGER NOT NULL DEFAULT 0,
+                   ADD COLUMN skyscrapers INTEGER NOT NULL DEFAULT 0,
+                   ADD COLUMN rubble INTEGER NOT NULL DEFAULT 0,
+                   ADD COLUMN buildings INTEGER GENERATED ALWAYS AS (houses + apartments + skyscrapers) STORED,
+                   ADD COLUMN best_streak INTEGER NOT NULL DEFAULT 0,
+                   ADD COLUMN total_days_completed INTEGER NOT NULL DEFAULT 0"""
+        )
+        rows = await conn.fetch("SELECT group_id, city_bits, grid_rows, grid_cols FROM groups FOR UPDATE")
+        await conn.executemany(
+            """UPDATE groups SET houses = $2, apartments = $3, skyscrapers = $4, rubble = $5, best_streak = streak
+               WHERE group_id = $1""",
+            [(r["group_id"], *(city_of(r).count(kind) for kind in _TILE_COUNTERS.values())) for r in rows],
+        )
+
+
+async def _load_code_key(conn: asyncpg.Connection):
+    global _code_key
+    await conn.execute(CREATE_CODE_ALLOCATOR)
+    await conn.execute(
+        "INSERT INTO app_settings (name, value) VALUES ('group_code_key', $1) ON CONFLICT DO NOTHING",
+        secrets.token_hex(32),
+    )
+    _code_key = bytes.fromhex(await conn.fetchval(
+        "SELECT value FROM app_settings WHERE name = 'group_code_key'"
+    ))
 
 
 async def close_pool():
@@ -47,95 +490,528 @@ async def close_pool():
         pool = None
 
 
-def _generate_group_code() -> str:
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-
-def row_to_response(row: asyncpg.Record) -> GroupResponse:
-    current_build = None
-    if row["current_build"]:
-        cb = json.loads(row["current_build"]) if isinstance(row["current_build"], str) else row["current_build"]
-        current_build = CurrentBuild(**cb)
-
-    pending_event = None
-    if row["pending_event"]:
-        pe = json.loads(row["pending_event"]) if isinstance(row["pending_event"], str) else row["pending_event"]
-        pending_event = PendingEvent(**pe)
-
-    city_map = json.loads(row["city_map"]) if isinstance(row["city_map"], str) else row["city_map"]
-
-    return GroupResponse(
-        group_id=row["group_id"],
-        group_code=row["group_code"],
-        group_name=row["group_name"],
-        group_members=list(row["group_members"]),
-        daily_goal=row["daily_goal"],
-        goal_reset_time=row["goal_reset_time"],
-        completions_today=list(row["completions_today"]),
-        streak=row["streak"],
-        current_build=current_build,
-        city_map=city_map,
-        last_processed_date=row["last_processed_date"],
-        pending_event=pending_event,
-        created_at=row["created_at"].isoformat(),
+@asynccontextmanager
+async def _acquire():
+    """pool.acquire(), recording how long we waited for a connection."""
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        metrics.POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+        yield conn
+
+
+def pool_stats() -> dict:
+    if pool is None:
+        return {}
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {"max": pool.get_max_size(), "open": size, "idle": idle, "in_use": size - idle}
+
+
+async def _run(conn: asyncpg.Connection, name: str, *args, many: bool = False):
+    """Run a named statement; it is already prepared on every pool connection."""
+    _named_counts[name] += 1
+    sql = STATEMENTS[name]
+    return await (conn.fetch(sql, *args) if many else conn.fetchrow(sql, *args))
+
+
+def statement_stats() -> dict:
+    """Executions per named statement, and how often update_group had to build SQL."""
+    return {
+        "named": dict(_named_counts),
+        "dynamic": _dynamic_count,
+        "dynamic_shapes": len(_dynamic_shapes),
+    }
+
+
+async def _next_group_code(conn: asyncpg.Connection) -> str:
+    """A code no other process will hand out: the next counter of this process's block, permuted."""
+    global _code_block
+    if not _code_block:
+        # Two callers refilling at once just waste a block
+        start = await conn.fetchval("SELECT nextval('group_code_seq')") - 1
+        _code_block = range(start, start + CODE_BLOCK_SIZE)
+    counter, _code_block = _code_block[0], _code_block[1:]
+    return group_codes.code_for(_code_key, counter)
+
+
+async def allocate_group_codes(conn: asyncpg.Connection, n: int) -> list[str]:
+    """n fresh codes at once, taking whole blocks from the sequence (for bulk loads)."""
+    starts = await conn.fetch(
+        "SELECT nextval('group_code_seq') - 1 AS start FROM generate_series(1, $1)",
+        -(-n // CODE_BLOCK_SIZE),
     )
+    counters = (c for row in starts for c in range(row["start"], row["start"] + CODE_BLOCK_SIZE))
+    return [group_codes.code_for(_code_key, next(counters)) for _ in range(n)]
+
+
+def city_of(row: asyncpg.Record) -> CityMap:
+    return CityMap.from_bytes(row["city_bits"], row["grid_rows"], row["grid_cols"])
+
+
+def city_columns(city: CityMap) -> dict:
+    """The _CITY_COLUMNS values for a city: free tiles and the leaderboard tile counts."""
+    return {
+        "free_tiles": city.free_count(),
+        **{column: city.count(kind) for column, kind in _TILE_COUNTERS.items()},
+    }
+
+
+def row_to_group(row: asyncpg.Record) -> dict:
+    """
+    A row as a GroupResponse-shaped dict, ready to serialize without going
+    through the pydantic model. Reuses the cached one if it's the same version.
+    """
+    cached = cache.lookup(row["group_id"], row["version"])
+    if cached is not None:
+        return cached
+
+    pending_event = row["pending_event"]
+    if pending_event:
+        pending_event = {key: pending_event.get(key) for key in PendingEvent.model_fields}
+
+    group = {
+        "group_id": row["group_id"],
+        "group_code": row["group_code"],
+        "group_name": row["group_name"],
+        "group_members": list(row["group_members"]),
+        "daily_goal": row["daily_goal"],
+        "goal_reset_time": row["goal_reset_time"],
+        "completions_today": list(row["completions_today"]),
+        "streak": row["streak"],
+        "current_build": row["current_build"] or None,
+        "city_map": city_of(row).to_json(),
+        "last_processed_date": row["last_processed_date"],
+        "pending_event": pending_event or None,
+        "created_at": row["created_at"].isoformat(),
+    }
+    cache.put(group, row["version"], max_age=(row["next_reset_at"] - datetime.now(timezone.utc)).total_seconds())
+    return group
+
+
+# groups_archive keeps these groups columns as columns of its own, and packs
+# the rest into data, with how non-JSON ones are written and read back.
+# last_active_at isn't kept: rehydration restarts the clock.
+_ARCHIVE_KEYS = ("group_id", "group_code", "group_members", "created_at")
+_PACKED_COLUMNS = (
+    "group_name", "daily_goal", "goal_reset_time", "completions_today", "streak", "current_build",
+    "city_bits", "grid_rows", "grid_cols", "free_tiles", "last_processed_date", "pending_event",
+    "version", "next_reset_at", "houses", "apartments", "skyscrapers", "rubble", "best_streak",
+    "total_days_completed",
+)
+_PACK = {"city_bits": bytes.hex, "next_reset_at": datetime.isoformat}
+_UNPACK = {"city_bits": bytes.fromhex, "next_reset_at": datetime.fromisoformat}
+_EVENT_COLUMNS = ("seq", "group_id", "event", "created_at")
+_SUMMARY_COLUMNS = ("group_id", "group_code", "group_name", "group_members", "streak", "current_build")
+
+
+def _pack_archived(row: asyncpg.Record, events: list[asyncpg.Record]) -> bytes:
+    """The row's _PACKED_COLUMNS as a JSON list, plus its events, zlib-compressed."""
+    values = [_PACK[col](row[col]) if col in _PACK else row[col] for col in _PACKED_COLUMNS]
+    logged = [[e["seq"], e["event"], e["created_at"].isoformat()] for e in events]
+    return zlib.compress(dumps([values, logged]), 9)
+
+
+def _unarchived(archived: asyncpg.Record) -> tuple[dict, list[tuple]]:
+    """The groups row an archive row came from (less last_active_at), and its group_events records."""
+    values, logged = loads(zlib.decompress(archived["data"]))
+    row = {col: archived[col] for col in _ARCHIVE_KEYS}
+    for col, val in zip(_PACKED_COLUMNS, values):
+        row[col] = _UNPACK[col](val) if col in _UNPACK else val
+    # Archived before the leaderboard counters were packed
+    if "houses" not in row:
+        row.update(city_columns(city_of(row)), best_streak=row["streak"], total_days_completed=0)
+    events = [(seq, row["group_id"], event, datetime.fromisoformat(at)) for seq, event, at in logged]
+    return row, events
 
 
-async def create_group(group_name: str, member: str, daily_goal: str, goal_reset_time: str) -> GroupResponse:
+async def _rehydrate(key: str, values: list[str]) -> bool:
+    """
+    Move groups back from the archive by group_id or group_code. True if any
+    were archived, in which case they are in groups now, whoever moved them.
+    """
+    if key == "group_code":
+        values = [value.upper() for value in values]
+    async with _acquire() as conn:
+        # Misses (unknown groups) stop at these index lookups. A group found in
+        # groups was moved back since the caller looked, so it's worth another look.
+        found = await conn.fetchrow(
+            f"""SELECT EXISTS (SELECT 1 FROM groups_archive WHERE {key} = ANY($1::text[])) AS archived,
+                       EXISTS (SELECT 1 FROM groups WHERE {key} = ANY($1::text[])) AS moved_back""",
+            values,
+        )
+        if not found["archived"]:
+            return found["moved_back"]
+        async with conn.transaction():
+            # A concurrent rehydration of the same group blocks here, then deletes nothing
+            archived = await conn.fetch(
+                f"DELETE FROM groups_archive WHERE {key} = ANY($1::text[]) RETURNING *", values,
+            )
+            unpacked = [_unarchived(row) for row in archived]
+            if unpacked:
+                columns = _ARCHIVE_KEYS + _PACKED_COLUMNS
+                await conn.copy_records_to_table(
+                    "groups", records=[tuple(row[col] for col in columns) for row, _ in unpacked], columns=columns,
+                )
+            events = [event for _, logged in unpacked for event in logged]
+            if events:
+                await conn.copy_records_to_table("group_events", records=events, columns=_EVENT_COLUMNS)
+    metrics.GROUP_ARCHIVE_MOVES.inc("rehydrated", amount=len(archived))
+    return True
+
+
+def _rehydrating(key: str):
+    """
+    Decorate a lookup by group_id or group_code: when it finds nothing and the
+    group is archived, move the group back and look again.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(value: str, *args, **kwargs):
+            row = await fn(value, *args, **kwargs)
+            if row is None and await _rehydrate(key, [value]):
+                row = await fn(value, *args, **kwargs)
+            return row
+        return wrapper
+    return decorate
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def create_group(
+    group_name: str, member: str, daily_goal: str, goal_reset_time: str,
+    grid_rows: int = GRID_ROWS, grid_cols: int = GRID_COLS,
+) -> dict:
     group_id = str(uuid.uuid4())
-    group_code = _generate_group_code()
-    city_map = json.dumps(EMPTY_CITY)
 
-    async with pool.acquire() as conn:
-        # Retry if code collision (unlikely with 6-char alphanumeric)
+    async with _acquire() as conn:
+        # Allocated codes never collide with each other, only with randomly
+        # generated ones from before the allocator
         for _ in range(5):
+            group_code = await _next_group_code(conn)
             try:
                 row = await conn.fetchrow(
                     """INSERT INTO groups (group_id, group_code, group_name, group_members,
-                       daily_goal, goal_reset_time, city_map)
-                       VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+                       daily_goal, goal_reset_time, grid_rows, grid_cols, free_tiles)
+                       VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
                        RETURNING *""",
                     group_id, group_code, group_name, [member],
-                    daily_goal, goal_reset_time, city_map,
+                    daily_goal, goal_reset_time, grid_rows, grid_cols, grid_rows * grid_cols,
                 )
-                return row_to_response(row)
+                return row_to_group(row)
             except asyncpg.UniqueViolationError:
-                group_code = _generate_group_code()
+                continue
         raise RuntimeError("Failed to generate unique group code")
 
 
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_id")
 async def get_group_by_id(group_id: str) -> asyncpg.Record | None:
-    async with pool.acquire() as conn:
+    async with _acquire() as conn:
         return await conn.fetchrow("SELECT * FROM groups WHERE group_id = $1", group_id)
 
 
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_id")
+async def get_group_version(group_id: str) -> asyncpg.Record | None:
+    """Just enough of the row to revalidate an ETag."""
+    async with _acquire() as conn:
+        return await conn.fetchrow(
+            "SELECT version, next_reset_at FROM groups WHERE group_id = $1", group_id,
+        )
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def get_groups_by_ids(group_ids: list[str]) -> list[asyncpg.Record]:
+    """Rows for whichever of group_ids exist, in no particular order."""
+    sql = "SELECT * FROM groups WHERE group_id = ANY($1::text[])"
+    async with _acquire() as conn:
+        rows = await conn.fetch(sql, group_ids)
+    missing = set(group_ids).difference(row["group_id"] for row in rows)
+    if missing and await _rehydrate("group_id", list(missing)):
+        async with _acquire() as conn:
+            rows += await conn.fetch(sql, list(missing))
+    return rows
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def get_groups_by_member(member: str) -> list[dict]:
+    """
+    Summary columns of every group member belongs to, oldest first (GIN index
+    lookups). Archived groups are listed from the archive without moving them back.
+    """
+    async with _acquire() as conn:
+        rows = await conn.fetch(
+            f"""SELECT {", ".join(_SUMMARY_COLUMNS)}, created_at
+               FROM groups
+               WHERE group_members @> ARRAY[$1]::text[]""",
+            member,
+        )
+        archived = await conn.fetch(
+            "SELECT * FROM groups_archive WHERE group_members @> ARRAY[$1]::text[]", member,
+        )
+    rows = [*rows, *(_unarchived(row)[0] for row in archived)]
+    rows.sort(key=lambda row: row["created_at"])
+    return [{col: row[col] for col in _SUMMARY_COLUMNS} for row in rows]
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_code")
 async def get_group_by_code(group_code: str) -> asyncpg.Record | None:
-    async with pool.acquire() as conn:
+    async with _acquire() as conn:
         return await conn.fetchrow(
             "SELECT * FROM groups WHERE group_code = $1",
             group_code.upper(),
         )
 
 
-async def update_group(group_id: str, **fields) -> asyncpg.Record:
+def _column_value(key: str, val):
+    return val.to_bytes() if key == "city_map" else val
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def update_group(group_id: str, events: list[dict] = (), **fields) -> asyncpg.Record:
+    """Write fields, and append events to the group's log in the same transaction."""
+    if "city_map" in fields:
+        fields.update(city_columns(fields["city_map"]))
+    async with _acquire() as conn:
+        if not events:
+            return await _update_fields(conn, group_id, fields)
+        async with conn.transaction():
+            row = await _update_fields(conn, group_id, fields)
+            if row:
+                await _run(conn, "event_append", group_id, list(events))
+            return row
+
+
+async def _update_fields(conn: asyncpg.Connection, group_id: str, fields: dict) -> asyncpg.Record:
+    shape = _UPDATE_STATEMENTS.get(frozenset(fields))
+    if shape is not None:
+        name, order = shape
+        return await _run(conn, name, group_id, *(_column_value(k, fields[k]) for k in order))
+
+    global _dynamic_count
+    _dynamic_count += 1
     sets = []
     vals = []
     i = 1
     for key, val in fields.items():
-        if key in ("city_map", "current_build", "pending_event"):
+        if key == "city_map":
+            sets.append(f"city_bits = ${i}")
+        elif key in ("current_build", "pending_event"):
             sets.append(f"{key} = ${i}::jsonb")
-            vals.append(json.dumps(val) if val is not None else None)
         else:
             sets.append(f"{key} = ${i}")
-            vals.append(val)
+        vals.append(_column_value(key, val))
         i += 1
     vals.append(group_id)
     sql = f"UPDATE groups SET {', '.join(sets)} WHERE group_id = ${i} RETURNING *"
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(sql, *vals)
+    _dynamic_shapes.add(sql)
+    return await conn.fetchrow(sql, *vals)
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_id")
+async def add_completion(group_id: str, member: str) -> asyncpg.Record | None:
+    if COALESCE_COMPLETIONS:
+        return await _add_completion_coalesced(group_id, member)
+    async with _acquire() as conn:
+        return await _run(conn, "completion_append", group_id, member)
+
+
+async def _add_completion_coalesced(group_id: str, member: str) -> asyncpg.Record | None:
+    """Queue the append for the next batch flush and wait for this caller's row."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending_completions.append((group_id, member, future))
+    if len(_pending_completions) >= COALESCE_MAX_BATCH:
+        _start_flush()
+    elif len(_pending_completions) == 1:
+        loop.call_later(COALESCE_WINDOW_SECONDS, _start_flush)
+    return await future
+
+
+def _start_flush():
+    global _pending_completions
+    if not _pending_completions:
+        return
+    batch, _pending_completions = _pending_completions, []
+    task = asyncio.get_running_loop().create_task(_flush_completions(batch))
+    _flushes.add(task)
+    task.add_done_callback(_flushes.discard)
+
+
+async def _flush_completions(batch: list[tuple[str, str, asyncio.Future]]):
+    try:
+        async with _acquire() as conn:
+            rows = await _run(
+                conn, "completion_append_batch",
+                [group_id for group_id, _, _ in batch],
+                [member for _, member, _ in batch],
+                many=True,
+            )
+    except Exception as exc:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+        return
+    by_n = {row["n"]: row for row in rows}
+    for n, (_, _, future) in enumerate(batch, 1):
+        # Callers that gave up (cancelled) are skipped; missing rows are unknown groups
+        if not future.done():
+            future.set_result(by_n.get(n))
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_code")
+async def add_member(group_code: str, member: str, max_members: int) -> asyncpg.Record | None:
+    async with _acquire() as conn:
+        return await _run(conn, "membership_add", group_code.upper(), member, max_members)
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+@_rehydrating("group_id")
+async def set_build_if_none(group_id: str, member: str, build: dict) -> asyncpg.Record | None:
+    async with _acquire() as conn:
+        return await _run(conn, "build_set", group_id, build, member)
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def fetch_due_groups(limit: int) -> list[asyncpg.Record]:
+    """Groups whose reset has passed, longest overdue first (an index range scan)."""
+    async with _acquire() as conn:
+        return await conn.fetch(
+            """SELECT * FROM groups
+               WHERE next_reset_at <= now()
+               ORDER BY next_reset_at
+               LIMIT $1""",
+            limit,
+        )
 
 
+async def make_due(group_ids: list[str]):
+    """
+    Pull the groups' next reset to now and their last processed date back a
+    day, as if their day had just ended, so the next rollover is a real one.
+    For load tests.
+    """
+    async with _acquire() as conn:
+        await conn.execute(
+            """UPDATE groups SET
+                   next_reset_at = now(),
+                   last_processed_date = to_char(last_processed_date::date - 1, 'YYYY-MM-DD')
+               WHERE group_id = ANY($1)""",
+            group_ids,
+        )
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def write_day_results(results: list[dict]) -> list[asyncpg.Record]:
+    """
+    Write a batch of end-of-day results in one statement.
+    Each result carries the full post-rollover state of a group and the events
+    it produced, computed from the row at the version it carries. Rows that
+    were already processed for that date (e.g. lazily by a request), or that
+    changed since that version, are left alone, and so are their events.
+    """
+    if not results:
+        return []
+
+    events = [(r["group_id"], event) for r in results for event in r.get("events", ())]
+    cities = [city_columns(r["city_map"]) for r in results]
+
+    async with _acquire() as conn:
+        return await _run(
+            conn, "day_rollover",
+            [r["group_id"] for r in results],
+            [r["streak"] for r in results],
+            [r["best_streak"] for r in results],
+            [r["completed_days"] for r in results],
+            [r["current_build"] for r in results],
+            [r["city_map"].to_bytes() for r in results],
+            *([city[column] for city in cities] for column in _CITY_COLUMNS),
+            [r["pending_event"] for r in results],
+            [r["last_processed_date"] for r in results],
+            [r["next_reset_at"] for r in results],
+            [r["version"] for r in results],
+            [group_id for group_id, _ in events],
+            [event for _, event in events],
+            many=True,
+        )
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def fetch_events(group_id: str, after: int, limit: int) -> list[asyncpg.Record]:
+    """A page of the group's event log, oldest first, strictly after seq `after`."""
+    async with _acquire() as conn:
+        return await conn.fetch(
+            """SELECT seq, event FROM group_events
+               WHERE group_id = $1 AND seq > $2
+               ORDER BY seq
+               LIMIT $3""",
+            group_id, after, limit,
+        )
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
 async def delete_group(group_id: str) -> bool:
-    async with pool.acquire() as conn:
+    async with _acquire() as conn:
         result = await conn.execute("DELETE FROM groups WHERE group_id = $1", group_id)
-        return result == "DELETE 1"
+        if result != "DELETE 1":
+            result = await conn.execute("DELETE FROM groups_archive WHERE group_id = $1", group_id)
+    cache.invalidate(group_id)
+    return result == "DELETE 1"
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def archive_inactive(idle: timedelta, limit: int) -> int:
+    """
+    Move up to limit groups nobody has acted on for idle into groups_archive,
+    longest idle first, events and all. Returns how many moved.
+    """
+    async with _acquire() as conn, conn.transaction():
+        # Locked until commit, so no write can land on a row after it was packed
+        rows = await conn.fetch(
+            """SELECT * FROM groups
+               WHERE last_active_at < now() - $1::interval
+               ORDER BY last_active_at
+               LIMIT $2
+               FOR UPDATE SKIP LOCKED""",
+            idle, limit,
+        )
+        if not rows:
+            return 0
+        group_ids = [row["group_id"] for row in rows]
+        events = defaultdict(list)
+        for event in await conn.fetch(
+            "SELECT * FROM group_events WHERE group_id = ANY($1::text[]) ORDER BY seq", group_ids,
+        ):
+            events[event["group_id"]].append(event)
+        await conn.copy_records_to_table(
+            "groups_archive",
+            records=[
+                (row["group_id"], row["group_code"], row["group_members"], row["created_at"],
+                 _pack_archived(row, events[row["group_id"]]))
+                for row in rows
+            ],
+            columns=("group_id", "group_code", "group_members", "created_at", "data"),
+        )
+        # Cascades to group_events; the delete trigger tells other processes' caches
+        await conn.execute("DELETE FROM groups WHERE group_id = ANY($1::text[])", group_ids)
+    for group_id in group_ids:
+        cache.invalidate(group_id)
+    metrics.GROUP_ARCHIVE_MOVES.inc("archived", amount=len(group_ids))
+    return len(group_ids)
+
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+async def top_groups(column: str, limit: int) -> list[asyncpg.Record]:
+    """The limit groups highest in a RANKED_COLUMNS column (an index scan), with their counters."""
+    if column not in RANKED_COLUMNS:
+        raise ValueError(f"Not a ranked column: {column}")
+    async with _acquire() as conn:
+        return await conn.fetch(
+            f"""SELECT group_id, group_name, houses, apartments, skyscrapers, rubble,
+                       buildings, best_streak, total_days_completed
+                FROM groups
+                ORDER BY {column} DESC, group_id
+                LIMIT $1""",
+            limit,
+        )
@@ -0,0 +1,76 @@
+"""
+Messages for the group websocket feed.
+
+A socket gets a snapshot on connect, then deltas against the last version it
+was sent:
+
+    {"type": "snapshot", "version": 7, "group": {...GroupResponse...}}
+    {"type": "delta", "base": 7, "version": 9, "changes": {...}}
+
+changes holds only what differs:
+    tiles               [[r, c, type or null], ...]
+    completions_added   members appended to completions_today
+    completions_today   the full list, when it was reset rather than appended to
+    current_build       the new build, or null
+    event               the new pending_event
+    fields              any other top-level fields that changed, by name
+
+A client whose version isn't a delta's base has missed something; it sends
+any message on the socket and gets a fresh snapshot.
+"""
+from collections import OrderedDict
+
+import database as db
+
+# (group_id, base, version) -> encoded delta, shared by every socket on the group
+_encoded: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+ENCODED_CACHE_SIZE = 1024
+
+_DIFFED = {"city_map", "completions_today", "current_build", "pending_event"}
+
+
+def snapshot(version: int, group: dict) -> str:
+    return db.dumps({"type": "snapshot", "version": version, "group": group}).decode()
+
+
+def delta(base: int, old: dict, version: int, new: dict) -> str:
+    key = (new["group_id"], base, version)
+    message = _encoded.get(key)
+    if message is None:
+        message = db.dumps({
+            "type": "delta", "base": base, "version": version, "changes": diff(old, new),
+        }).decode()
+        _encoded[key] = message
+        if len(_encoded) > ENCODED_CACHE_SIZE:
+            _encoded.popitem(last=False)
+    return message
+
+
+def diff(old: dict, new: dict) -> dict:
+    changes: dict = {}
+
+    tiles = [
+        [int(r), c, value]
+        for r, row in new["city_map"].items()
+        for c, value in enumerate(row)
+        if old["city_map"][r][c] != value
+    ]
+    if tiles:
+        changes["tiles"] = tiles
+
+    before, after = old["completions_today"], new["completions_today"]
+    if after[:len(before)] == before:
+        if len(after) > len(before):
+            changes["completions_added"] = after[len(before):]
+    else:
+        changes["completions_today"] = after
+
+    if new["current_build"] != old["current_build"]:
+        changes["current_build"] = new["current_build"]
+    if new["pending_event"] != old["pending_event"]:
+        changes["event"] = new["pending_event"]
+
+    fields = {k: v for k, v in new.items() if k not in _DIFFED and old.get(k) != v}
+    if fields:
+        changes["fields"] = fields
+    return changes
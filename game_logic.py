@@ -1,34 +1,25 @@
+import functools
+import hashlib
 import random
 import uuid
 from datetime import datetime, timezone, timedelta
 
+import metrics
+
 
 BUILDING_DAYS = {"house": 1, "apartment": 3, "skyscraper": 7}
 
+MAX_MEMBERS = 4
+
 # Weights for asteroid targeting (higher = more likely to be hit)
 DESTROY_WEIGHTS = {"house": 3, "apartment": 2, "skyscraper": 1}
 
+_default_rng = random.Random()
 
-def needs_day_processing(goal_reset_time: str, last_processed_date: str | None) -> bool:
-    """Check if end-of-day processing should run."""
-    now = datetime.now(timezone.utc)
-    hour, minute = map(int, goal_reset_time.split(":"))
-
-    # Build today's reset datetime in UTC
-    reset_today = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-
-    # If we haven't passed today's reset yet, no processing needed
-    if now < reset_today:
-        # Check against yesterday's date
-        check_date = (reset_today - timedelta(days=1)).strftime("%Y-%m-%d")
-    else:
-        check_date = reset_today.strftime("%Y-%m-%d")
-
-    # If already processed for this period, skip
-    if last_processed_date == check_date:
-        return False
 
-    return True
+def needs_day_processing(next_reset_at: datetime) -> bool:
+    """Check if end-of-day processing should run."""
+    return datetime.now(timezone.utc) >= next_reset_at
 
 
 def get_processing_date(goal_reset_time: str) -> str:
@@ -42,42 +33,205 @@ def get_processing_date(goal_reset_time: str) -> str:
     return reset_today.strftime("%Y-%m-%d")
 
 
+def next_reset_at(goal_reset_time: str, processing_date: str) -> datetime:
+    """When the period that started on processing_date ends, i.e. the group is next due."""
+    hour, minute = map(int, goal_reset_time.split(":"))
+    day = datetime.strptime(processing_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return day + timedelta(days=1, hours=hour, minutes=minute)
+
+
+# Default grid; each group can have its own size, up to MAX_GRID_SIDE a side
 GRID_ROWS = 4
 GRID_COLS = 5
+MAX_GRID_SIDE = 20
+
+# Each tile is a 3-bit code. Buildings have a non-zero low two bits, so a
+# tile is free (empty or rubble) exactly when those two bits are clear.
+TILE_BITS = 3
+TILE_CODES = {None: 0, "house": 1, "apartment": 2, "skyscraper": 3, "rubble": 4}
+TILE_TYPES = {code: kind for kind, code in TILE_CODES.items()}
 
+_TILE_MASK = (1 << TILE_BITS) - 1
 
-def _find_empty_tiles(city_map: dict[str, list]) -> list[list[int]]:
-    """Find all empty or rubble tiles."""
-    tiles = []
-    for r in range(GRID_ROWS):
-        for c in range(GRID_COLS):
-            if city_map[str(r)][c] is None or city_map[str(r)][c] == "rubble":
-                tiles.append([r, c])
-    return tiles
 
+@functools.cache
+def _low_bits(tiles: int) -> int:
+    """Lowest bit of every tile in a grid of this many tiles."""
+    return sum(1 << (TILE_BITS * i) for i in range(tiles))
 
-def _find_occupied_tiles(city_map: dict[str, list]) -> list[tuple[int, int, str]]:
-    """Find all tiles with buildings. Returns (row, col, building_type)."""
-    tiles = []
-    for r in range(GRID_ROWS):
-        for c in range(GRID_COLS):
-            cell = city_map[str(r)][c]
-            if cell in ("house", "apartment", "skyscraper"):
-                tiles.append((r, c, cell))
-    return tiles
 
+class CityMap:
+    """
+    A rows x cols city grid packed row-major into one int, TILE_BITS per tile.
+    Immutable: with_tile returns a new map.
+    """
 
+    __slots__ = ("bits", "rows", "cols")
+
+    def __init__(self, bits: int = 0, rows: int = GRID_ROWS, cols: int = GRID_COLS):
+        self.bits = bits
+        self.rows = rows
+        self.cols = cols
+
+    @classmethod
+    def from_json(cls, city_map: dict[str, list]) -> "CityMap":
+        rows, cols = len(city_map), len(city_map["0"])
+        bits = 0
+        for r in range(rows):
+            for c in range(cols):
+                bits |= TILE_CODES[city_map[str(r)][c]] << (TILE_BITS * (r * cols + c))
+        return cls(bits, rows, cols)
+
+    def to_json(self) -> dict[str, list]:
+        return {
+            str(r): [self.get(r, c) for c in range(self.cols)]
+            for r in range(self.rows)
+        }
+
+    @classmethod
+    def from_bytes(cls, data: bytes, rows: int, cols: int) -> "CityMap":
+        return cls(int.from_bytes(data, "big"), rows, cols)
+
+    def to_bytes(self) -> bytes:
+        return self.bits.to_bytes((self.rows * self.cols * TILE_BITS + 7) // 8, "big")
+
+    def get(self, r: int, c: int) -> str | None:
+        return TILE_TYPES[(self.bits >> (TILE_BITS * (r * self.cols + c))) & _TILE_MASK]
+
+    def with_tile(self, r: int, c: int, kind: str | None) -> "CityMap":
+        shift = TILE_BITS * (r * self.cols + c)
+        bits = (self.bits & ~(_TILE_MASK << shift)) | (TILE_CODES[kind] << shift)
+        return CityMap(bits, self.rows, self.cols)
+
+    def occupied_mask(self) -> int:
+        """Lowest bit of each tile holding a building."""
+        return (self.bits | (self.bits >> 1)) & _low_bits(self.rows * self.cols)
+
+    def free_mask(self) -> int:
+        """Lowest bit of each empty or rubble tile."""
+        return ~self.occupied_mask() & _low_bits(self.rows * self.cols)
+
+    def free_count(self) -> int:
+        return self.free_mask().bit_count()
+
+    def count(self, kind: str | None) -> int:
+        """How many tiles hold kind: the tiles whose code XORs to zero against it."""
+        low = _low_bits(self.rows * self.cols)
+        diff = self.bits ^ (TILE_CODES[kind] * low)
+        return self.rows * self.cols - ((diff | (diff >> 1) | (diff >> 2)) & low).bit_count()
+
+    def has_empty(self) -> bool:
+        return self.free_mask() != 0
+
+    def nth_free(self, k: int) -> list[int]:
+        """The k-th (from 0) empty or rubble tile, row-major, as [row, col]."""
+        return list(divmod(_nth_tile(self.free_mask(), k), self.cols))
+
+    def empty_tiles(self) -> list[list[int]]:
+        """All empty or rubble tiles, row-major."""
+        return [list(divmod(i, self.cols)) for i in _tile_indexes(self.free_mask())]
+
+    def occupied_tiles(self) -> list[tuple[int, int, str]]:
+        """All tiles with buildings, row-major. Returns (row, col, building_type)."""
+        tiles = []
+        for i in _tile_indexes(self.occupied_mask()):
+            r, c = divmod(i, self.cols)
+            tiles.append((r, c, TILE_TYPES[(self.bits >> (TILE_BITS * i)) & _TILE_MASK]))
+        return tiles
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, CityMap)
+            and (self.bits, self.rows, self.cols) == (other.bits, other.rows, other.cols)
+        )
+
+    def __repr__(self) -> str:
+        return f"CityMap({self.bits:#x}, {self.rows}, {self.cols})"
+
+
+def _tile_indexes(mask: int):
+    """Tile indexes of the set bits in a tile-aligned low-bit mask, ascending."""
+    while mask:
+        low = mask & -mask
+        yield (low.bit_length() - 1) // TILE_BITS
+        mask ^= low
+
+
+# Tiles per popcount step in _nth_tile, sized so a chunk fits a machine word
+_CHUNK_TILES = 21
+_CHUNK_MASK = (1 << (TILE_BITS * _CHUNK_TILES)) - 1
+
+
+def _nth_tile(mask: int, k: int) -> int:
+    """Index of the k-th (from 0) tile set in a tile-aligned low-bit mask."""
+    base = 0
+    while mask:
+        chunk = mask & _CHUNK_MASK
+        count = chunk.bit_count()
+        if k < count:
+            for i in _tile_indexes(chunk):
+                if not k:
+                    return base + i
+                k -= 1
+        k -= count
+        mask >>= TILE_BITS * _CHUNK_TILES
+        base += _CHUNK_TILES
+    raise IndexError("Not that many tiles set")
+
+
+class _Fenwick:
+    """Integer weights with O(log n) point updates and prefix-sum search."""
+
+    __slots__ = ("tree", "total")
+
+    def __init__(self, weights: list[int]):
+        n = len(weights)
+        tree = [0, *weights]
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = sum(weights)
+
+    def add(self, i: int, delta: int):
+        self.total += delta
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, target: float) -> int:
+        """First index whose running total exceeds target, like bisect over cumulative weights."""
+        pos, acc = 0, 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and acc + self.tree[nxt] <= target:
+                pos = nxt
+                acc += self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+@metrics.day_processing
 def process_end_of_day(
     group_members: list[str],
     completions_today: list[str],
     current_build: dict | None,
-    city_map: dict[str, list],
+    city_map: CityMap,
     streak: int,
+    rng: random.Random | None = None,
 ) -> dict:
     """
     Pure function: returns a dict of fields to update on the group row.
     Does NOT modify inputs.
+
+    Randomness comes only from rng.random(), in a fixed order: one draw for
+    the placed tile, or one for the asteroid size followed by one per
+    destroyed building. simulate.py relies on this to reproduce it exactly.
     """
+    rng = rng or _default_rng
     updates: dict = {
         "completions_today": [],
     }
@@ -94,13 +248,11 @@ def process_end_of_day(
 
         if new_days >= current_build["days_required"]:
             # Building complete — place on random empty/rubble tile
-            empty = _find_empty_tiles(city_map)
-            new_map = {k: row[:] for k, row in city_map.items()}  # deep copy
+            n_free = city_map.free_count()
 
-            if empty:
-                tile = random.choice(empty)
-                new_map[str(tile[0])][tile[1]] = current_build["type"]
-                updates["city_map"] = new_map
+            if n_free:
+                tile = city_map.nth_free(int(rng.random() * n_free))
+                updates["city_map"] = city_map.with_tile(tile[0], tile[1], current_build["type"])
                 updates["pending_event"] = {
                     "event_id": f"evt_{uuid.uuid4().hex[:12]}",
                     "type": "build_complete",
@@ -123,54 +275,105 @@ def process_end_of_day(
         updates["streak"] = 0
         updates["current_build"] = None
 
-        occupied = _find_occupied_tiles(city_map)
-        if len(occupied) > 0:
-            # Determine how many to destroy (1-3, but leave at least 1)
-            max_destroy = min(3, len(occupied) - 1)
-            if max_destroy < 1:
-                max_destroy = 1 if len(occupied) > 1 else 0
-
-            if max_destroy > 0:
-                n_destroy = random.randint(1, max_destroy)
-
-                # Weighted selection
-                weights = [DESTROY_WEIGHTS.get(t[2], 1) for t in occupied]
-
-                # If destroying all would wipe the city, ensure at least 1 survives
-                if n_destroy >= len(occupied):
-                    n_destroy = len(occupied) - 1
-
-                if n_destroy > 0:
-                    destroyed = random.sample(
-                        list(range(len(occupied))),
-                        k=min(n_destroy, len(occupied)),
-                    )
-                    # Use weighted selection instead of uniform
-                    destroyed_indices = []
-                    remaining = list(range(len(occupied)))
-                    remaining_weights = weights[:]
-                    for _ in range(n_destroy):
-                        if not remaining:
-                            break
-                        idx = random.choices(remaining, weights=remaining_weights, k=1)[0]
-                        destroyed_indices.append(idx)
-                        pos = remaining.index(idx)
-                        remaining.pop(pos)
-                        remaining_weights.pop(pos)
-
-                    new_map = {k: row[:] for k, row in city_map.items()}
-                    tiles_destroyed = []
-                    for idx in destroyed_indices:
-                        r, c, _ = occupied[idx]
-                        new_map[str(r)][c] = "rubble"
-                        tiles_destroyed.append([r, c])
-
-                    updates["city_map"] = new_map
-                    updates["pending_event"] = {
-                        "event_id": f"evt_{uuid.uuid4().hex[:12]}",
-                        "type": "asteroid",
-                        "tiles_destroyed": tiles_destroyed,
-                        "timestamp": now_iso,
-                    }
+        occupied = city_map.occupied_tiles()
+
+        # Destroy 1-3 buildings, but always leave at least 1 standing
+        max_destroy = min(3, len(occupied) - 1)
+        if max_destroy > 0:
+            n_destroy = 1 + int(rng.random() * max_destroy)
+
+            # Weighted selection without replacement; each pick draws the way
+            # rng.choices does over the buildings still standing
+            weights = [DESTROY_WEIGHTS.get(t[2], 1) for t in occupied]
+            standing = _Fenwick(weights)
+
+            new_map = city_map
+            tiles_destroyed = []
+            for _ in range(n_destroy):
+                idx = standing.find(rng.random() * standing.total)
+                standing.add(idx, -weights[idx])
+                r, c, _ = occupied[idx]
+                new_map = new_map.with_tile(r, c, "rubble")
+                tiles_destroyed.append([r, c])
+
+            updates["city_map"] = new_map
+            updates["pending_event"] = {
+                "event_id": f"evt_{uuid.uuid4().hex[:12]}",
+                "type": "asteroid",
+                "tiles_destroyed": tiles_destroyed,
+                "timestamp": now_iso,
+            }
 
     return updates
+
+
+def day_seed(group_id: str, date: str) -> str:
+    """Seed for the period starting on date; the same group and day always roll the same."""
+    return f"{group_id}:{date}"
+
+
+def catch_up(
+    group_id: str,
+    group_members: list[str],
+    completions_today: list[str],
+    current_build: dict | None,
+    city_map: CityMap,
+    streak: int,
+    goal_reset_time: str,
+    last_processed_date: str | None,
+    processing_date: str,
+) -> tuple[dict, list[dict]]:
+    """
+    Close every period from last_processed_date up to processing_date in memory.
+    Returns (updates, events): updates in process_end_of_day's shape, covering
+    all the periods, and every event they produced, oldest first. updates also
+    tallies the periods for the leaderboard counters: best_streak, the highest
+    streak reached (at least the one passed in), and completed_days, how many
+    periods every member completed.
+
+    Only the first period has completions; the ones nobody visited have none.
+    Each period uses its own day_seed, which also derives its event ids, so
+    replaying a catch-up gives the same city and events.
+    """
+    end = datetime.strptime(processing_date, "%Y-%m-%d")
+    if last_processed_date is None:
+        day = end - timedelta(days=1)
+    else:
+        day = datetime.strptime(last_processed_date, "%Y-%m-%d")
+
+    events = []
+    updates: dict = {"completions_today": []}
+    best_streak, completed_days = streak, 0
+    while day < end:
+        date = day.strftime("%Y-%m-%d")
+        seed = day_seed(group_id, date)
+        if set(group_members).issubset(completions_today):
+            completed_days += 1
+        day_updates = process_end_of_day(
+            group_members, completions_today, current_build, city_map, streak,
+            rng=random.Random(seed),
+        )
+        event = day_updates.get("pending_event")
+        if event:
+            event = {
+                **event,
+                "event_id": f"evt_{hashlib.sha256(seed.encode()).hexdigest()[:12]}",
+                "timestamp": next_reset_at(goal_reset_time, date).isoformat(),
+            }
+            day_updates["pending_event"] = event
+            events.append(event)
+        updates.update(day_updates)
+
+        completions_today = []
+        current_build = updates.get("current_build", current_build)
+        city_map = updates.get("city_map", city_map)
+        streak = updates.get("streak", streak)
+        best_streak = max(best_streak, streak)
+        # With no build and no completions every further period is a no-op
+        if current_build is None:
+            break
+        day += timedelta(days=1)
+
+    updates["best_streak"] = best_streak
+    updates["completed_days"] = completed_days
+    return updates, events
@@ -0,0 +1,51 @@
+"""
+Group codes from a keyed permutation of a counter.
+
+Code n is a Feistel permutation of n over [0, CODE_SPACE), so distinct
+counters always give distinct codes, and without the key consecutive codes
+look unrelated. database.py hands out counters in blocks from a sequence.
+"""
+import hashlib
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH  # ~2.18e9, just over 2**31
+
+_HALF_BITS = 16
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 6
+
+
+def _round(key: bytes, i: int, half: int) -> int:
+    digest = hashlib.blake2b(bytes((i,)) + half.to_bytes(2, "big"), key=key, digest_size=2).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _feistel(key: bytes, n: int) -> int:
+    """A permutation of 32-bit integers."""
+    left, right = n >> _HALF_BITS, n & _HALF_MASK
+    for i in range(_ROUNDS):
+        left, right = right, left ^ _round(key, i, right)
+    return (left << _HALF_BITS) | right
+
+
+def permute(key: bytes, n: int) -> int:
+    """A permutation of [0, CODE_SPACE): walk the 32-bit cycle until it lands inside."""
+    if not 0 <= n < CODE_SPACE:
+        raise ValueError("Group code counter exhausted")
+    n = _feistel(key, n)
+    while n >= CODE_SPACE:
+        n = _feistel(key, n)
+    return n
+
+
+def encode(n: int) -> str:
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, digit = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(chars)
+
+
+def code_for(key: bytes, counter: int) -> str:
+    return encode(permute(key, counter))
@@ -0,0 +1,64 @@
+"""
+Leaderboards, served from a snapshot refreshed every LEADERBOARD_REFRESH_SECONDS.
+
+Each board ranks groups by one of the counters kept on the groups row as the
+city changes (see database.RANKED_COLUMNS), so a refresh is an index scan per
+board rather than a pass over every city. Tied groups share a rank (1, 2, 2, 4).
+Archived groups drop off until they are active again.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from storage import backend as db
+
+log = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", "100"))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get("LEADERBOARD_REFRESH_SECONDS", "60"))
+
+# Board name -> the column it ranks by
+BOARDS = {"city": "buildings", "streak": "best_streak", "days": "total_days_completed"}
+
+_snapshot: dict = {}
+_lock = asyncio.Lock()
+
+
+def _ranked(rows, column: str) -> list[dict]:
+    entries = []
+    for i, row in enumerate(rows):
+        entry = dict(row)
+        tied = entries and entries[-1][column] == entry[column]
+        entry["rank"] = entries[-1]["rank"] if tied else i + 1
+        entries.append(entry)
+    return entries
+
+
+async def refresh():
+    global _snapshot
+    boards = {}
+    for board, column in BOARDS.items():
+        boards[board] = _ranked(await db.top_groups(column, LEADERBOARD_SIZE), column)
+    _snapshot = {"generated_at": datetime.now(timezone.utc).isoformat(), "boards": boards}
+
+
+async def snapshot() -> dict:
+    """The current snapshot, built on first use if the refresher hasn't run yet."""
+    if not _snapshot:
+        async with _lock:
+            if not _snapshot:
+                await refresh()
+    return _snapshot
+
+
+async def run_forever():
+    while True:
+        try:
+            async with _lock:
+                await refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Leaderboard refresh failed")
+        await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
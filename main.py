@@ -1,16 +1,26 @@
-import json
+import asyncio
 import random
 from contextlib import asynccontextmanager
+from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
-import database as db
-from models import CreateGroup, JoinGroup, CompleteGoal, SelectBuild, FillCity, GroupResponse
+import cache
+import feed
+import leaderboard
+import metrics
+import notifications
+import storage
+import sweeper
+from models import (
+    CreateGroup, JoinGroup, CompleteGoal, SelectBuild, FillCity, GroupIds, GroupResponse, GroupSummary,
+    EventPage, Leaderboard,
+)
+from storage import backend as db
 from game_logic import (
-    needs_day_processing, get_processing_date, process_end_of_day, BUILDING_DAYS,
-    _find_occupied_tiles, _find_empty_tiles,
+    needs_day_processing, get_processing_date, process_end_of_day, BUILDING_DAYS, MAX_MEMBERS,
 )
 
 load_dotenv()
@@ -19,7 +29,15 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db.init_pool()
+    # The memory backend publishes its own changes; there's nothing to LISTEN to
+    if storage.BACKEND == "postgres":
+        await notifications.start()
+    sweep_task = asyncio.create_task(sweeper.run_forever())
+    leaderboard_task = asyncio.create_task(leaderboard.run_forever())
     yield
+    sweep_task.cancel()
+    leaderboard_task.cancel()
+    await notifications.stop()
     await db.close_pool()
 
 
@@ -30,101 +48,284 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
+)
+app.add_middleware(metrics.TimingMiddleware)
+
+metrics.Collected(
+    "db_pool_connections", "Pool connections by state.", "gauge", ("state",),
+    lambda: {(state,): n for state, n in db.pool_stats().items()},
+)
+metrics.Collected(
+    "group_cache_entries", "Groups held in the response cache.", "gauge", (),
+    lambda: {(): cache.stats()["size"]},
+)
+metrics.Collected(
+    "group_cache_lookups_total", "Response cache lookups by result.", "counter", ("result",),
+    lambda: {("hit",): cache.stats()["hits"], ("miss",): cache.stats()["misses"]},
+)
+metrics.Collected(
+    "db_statement_executions_total", "Writes by named statement; dynamic = update_group built its own SQL.",
+    "counter", ("statement",),
+    lambda: {
+        **{(name,): n for name, n in db.statement_stats()["named"].items()},
+        ("dynamic",): db.statement_stats()["dynamic"],
+    },
 )
 
 
 # --- Helpers ---
 
-async def maybe_process_day(row) -> GroupResponse:
-    """Run lazy end-of-day processing if needed, then return response."""
-    if needs_day_processing(row["goal_reset_time"], row["last_processed_date"]):
-        current_build = row["current_build"]
-        if isinstance(current_build, str):
-            current_build = json.loads(current_build)
+# (group_id, next_reset_at) -> the rollover in flight for it in this process.
+# Finished ones linger briefly for callers still holding the pre-rollover row.
+_rollovers: dict[tuple, asyncio.Task] = {}
+ROLLOVER_LINGER_SECONDS = 1.0
+
+MAX_BATCH_IDS = 100
+
+
+async def _rollover(row):
+    while True:
+        result = sweeper.rollover(row, get_processing_date(row["goal_reset_time"]))
+        written = await db.write_day_results([result])
+        if written:
+            return written[0]
+        # Nothing written: another process (or the sweeper) processed it first,
+        # or a write landed after row was read and it has to be rolled again
+        fresh = await db.get_group_by_id(row["group_id"])
+        if fresh is None or fresh["version"] == row["version"] or not needs_day_processing(fresh["next_reset_at"]):
+            return fresh
+        row = fresh
+
+
+async def maybe_process_day(row) -> dict:
+    """
+    Run lazy end-of-day processing if needed, then return the group.
+    The background sweeper normally gets there first; this covers the gap
+    between a reset passing and the next sweep. Concurrent callers for the
+    same group share one rollover.
+    """
+    return db.row_to_group(await _process_if_due(row))
+
+
+async def _process_if_due(row):
+    if needs_day_processing(row["next_reset_at"]):
+        key = (row["group_id"], row["next_reset_at"])
+        task = _rollovers.get(key)
+        if task is None:
+            task = _rollovers[key] = asyncio.create_task(_rollover(row))
+            task.add_done_callback(lambda _: asyncio.get_running_loop().call_later(
+                ROLLOVER_LINGER_SECONDS, _rollovers.pop, key, None,
+            ))
+        # Shielded so a disconnecting caller doesn't cancel it for the others
+        row = await asyncio.shield(task)
+    return row
+
+
+def group_response(group: dict | list, status_code: int = 200, headers: dict | None = None) -> Response:
+    """Serialize a group straight to JSON bytes, skipping response_model validation."""
+    return Response(db.dumps(group), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: str, version: int) -> bool:
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag(version) in tags
 
-        city_map = row["city_map"]
-        if isinstance(city_map, str):
-            city_map = json.loads(city_map)
 
-        updates = process_end_of_day(
-            group_members=list(row["group_members"]),
-            completions_today=list(row["completions_today"]),
-            current_build=current_build,
-            city_map=city_map,
-            streak=row["streak"],
-        )
-        updates["last_processed_date"] = get_processing_date(row["goal_reset_time"])
+async def current_version(group_id: str) -> int | None:
+    """The group's version without building it, or None if unknown or its day is due."""
+    version = cache.version(group_id)
+    if version is not None:
+        return version
+    row = await db.get_group_version(group_id)
+    if row is None or needs_day_processing(row["next_reset_at"]):
+        return None
+    return row["version"]
 
-        row = await db.update_group(row["group_id"], **updates)
 
-    return db.row_to_response(row)
+async def load_group(group_id: str) -> dict | None:
+    """Current state of a group, from the cache when possible (entries expire when the day is due)."""
+    loaded = await load_group_versioned(group_id)
+    return loaded[1] if loaded else None
+
+
+async def load_group_versioned(group_id: str) -> tuple[int, dict] | None:
+    """load_group, along with the version the group was built from."""
+    loaded = cache.get_versioned(group_id)
+    if loaded is not None:
+        return loaded
+
+    row = await db.get_group_by_id(group_id)
+    if not row:
+        return None
+    row = await _process_if_due(row)
+    if not row:
+        return None
+    return row["version"], db.row_to_group(row)
+
+
+async def load_groups(group_ids: list[str]) -> list[dict | None]:
+    """
+    Like load_group for many groups, in order: cache hits first, one query
+    for the rest, and one batched write for any that are due.
+    """
+    groups = {gid: cache.get(gid) for gid in dict.fromkeys(group_ids)}
+    missing = [gid for gid, group in groups.items() if group is None]
+    if missing:
+        rows = await db.get_groups_by_ids(missing)
+        due = [row for row in rows if needs_day_processing(row["next_reset_at"])]
+        if due:
+            written = await db.write_day_results([
+                sweeper.rollover(row, get_processing_date(row["goal_reset_time"])) for row in due
+            ])
+            # Due rows someone else processed first are re-read, and rolled
+            # again if a write that landed since left them still due
+            done = {row["group_id"] for row in written}
+            stale = [row["group_id"] for row in due if row["group_id"] not in done]
+            rerolled = [await _process_if_due(row) for row in (await db.get_groups_by_ids(stale) if stale else [])]
+            fresh = written + [row for row in rerolled if row]
+            by_id = {row["group_id"]: row for row in rows} | {row["group_id"]: row for row in fresh}
+            rows = list(by_id.values())
+        for row in rows:
+            groups[row["group_id"]] = db.row_to_group(row)
+    return [groups[gid] for gid in group_ids]
 
 
 # --- Endpoints ---
 
 @app.post("/groups", response_model=GroupResponse, status_code=201)
 async def create_group(body: CreateGroup):
-    return await db.create_group(
+    group = await db.create_group(
         group_name=body.group_name,
         member=body.member,
         daily_goal=body.daily_goal,
         goal_reset_time=body.goal_reset_time,
+        grid_rows=body.grid_rows,
+        grid_cols=body.grid_cols,
     )
+    return group_response(group, status_code=201)
+
+
+@app.get("/groups", response_model=list[Optional[GroupResponse]])
+async def get_groups(ids: str = Query(..., description="Comma-separated group ids")):
+    """Groups in the order requested; null for ids that don't exist."""
+    return await _groups_response([gid for gid in ids.split(",") if gid])
+
+
+@app.post("/groups/batch", response_model=list[Optional[GroupResponse]])
+async def get_groups_batch(body: GroupIds):
+    return await _groups_response(body.ids)
+
+
+async def _groups_response(group_ids: list[str]) -> Response:
+    if len(group_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return group_response(await load_groups(group_ids))
 
 
 @app.get("/groups/{group_id}", response_model=GroupResponse)
-async def get_group(group_id: str):
-    row = await db.get_group_by_id(group_id)
-    if not row:
+async def get_group(group_id: str, if_none_match: str | None = Header(None)):
+    # Revalidation: answered from the cached or stored version alone
+    if if_none_match:
+        version = await current_version(group_id)
+        if version is not None and etag_matches(if_none_match, version):
+            return Response(status_code=304, headers={"ETag": etag(version)})
+
+    loaded = await load_group_versioned(group_id)
+    if loaded is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    return await maybe_process_day(row)
+    version, group = loaded
+    return group_response(group, headers={"ETag": etag(version)})
+
+
+@app.get("/groups/{group_id}/events", response_model=EventPage)
+async def get_group_events(group_id: str, after: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500)):
+    # Loading the group first runs any due rollover, so its events are included
+    if await load_group(group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    rows = await db.fetch_events(group_id, after, limit)
+    events = [{**row["event"], "seq": row["seq"]} for row in rows]
+    return group_response({"events": events, "cursor": rows[-1]["seq"] if rows else after})
+
+
+@app.get("/members/{member}/groups", response_model=list[GroupSummary])
+async def get_member_groups(member: str):
+    """Every group member is in. Streaks and builds are as of each group's last write."""
+    rows = await db.get_groups_by_member(member)
+    return group_response([dict(row) for row in rows])
+
+
+@app.get("/leaderboard", response_model=Leaderboard)
+async def get_leaderboard(
+    board: str = Query("city", description=f"One of {', '.join(leaderboard.BOARDS)}"),
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_SIZE),
+):
+    """Top groups by city size, best streak or days completed, as of the last refresh."""
+    if board not in leaderboard.BOARDS:
+        raise HTTPException(status_code=400, detail=f"Unknown board; expected one of {', '.join(leaderboard.BOARDS)}")
+    snapshot = await leaderboard.snapshot()
+    return group_response({
+        "board": board,
+        "generated_at": snapshot["generated_at"],
+        "entries": snapshot["boards"][board][:limit],
+    })
 
 
 @app.post("/groups/join", response_model=GroupResponse)
 async def join_group(body: JoinGroup):
-    row = await db.get_group_by_code(body.group_code)
+    # Idempotent — joining again leaves the row unchanged
+    group = cache.get_by_code(body.group_code)
+    if group is not None and body.member in group["group_members"]:
+        return group_response(group)
+
+    row = await db.add_member(body.group_code, body.member, MAX_MEMBERS)
     if not row:
         raise HTTPException(status_code=404, detail="Invalid group code")
 
-    members = list(row["group_members"])
+    if not row["applied"] and body.member not in row["group_members"]:
+        raise HTTPException(status_code=400, detail=f"Group is full (max {MAX_MEMBERS} members)")
 
-    # Idempotent — already a member
-    if body.member in members:
-        return await maybe_process_day(row)
-
-    if len(members) >= 4:
-        raise HTTPException(status_code=400, detail="Group is full (max 4 members)")
-
-    members.append(body.member)
-    row = await db.update_group(row["group_id"], group_members=members)
-    return await maybe_process_day(row)
+    return group_response(await maybe_process_day(row))
 
 
 @app.post("/groups/{group_id}/complete", response_model=GroupResponse)
 async def complete_goal(group_id: str, body: CompleteGoal):
-    row = await db.get_group_by_id(group_id)
+    # Idempotent — repeat taps are answered from the cache
+    group = cache.get(group_id)
+    if group is not None and body.member in group["completions_today"]:
+        return group_response(group)
+
+    row = await db.add_completion(group_id, body.member)
     if not row:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    members = list(row["group_members"])
-    if body.member not in members:
-        raise HTTPException(status_code=400, detail="Not a member of this group")
+    if not row["applied"]:
+        if body.member not in row["group_members"]:
+            raise HTTPException(status_code=400, detail="Not a member of this group")
 
-    # Run day processing first
-    if needs_day_processing(row["goal_reset_time"], row["last_processed_date"]):
-        resp = await maybe_process_day(row)
-        # Re-fetch after processing
-        row = await db.get_group_by_id(group_id)
-
-    completions = list(row["completions_today"])
+        # Day rolled over since the last write — process it, then retry
+        if needs_day_processing(row["next_reset_at"]):
+            await maybe_process_day(row)
+            row = await db.add_completion(group_id, body.member)
+            if not row:
+                raise HTTPException(status_code=404, detail="Group not found")
 
-    # Idempotent
-    if body.member in completions:
-        return db.row_to_response(row)
+    if not row["applied"] and body.member not in row["completions_today"]:
+        # A concurrent tap by the same member can commit after this statement's
+        # snapshot, leaving the row it returned without them; look again
+        row = await db.get_group_by_id(group_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Group not found")
+        if body.member not in row["completions_today"] or needs_day_processing(row["next_reset_at"]):
+            raise HTTPException(status_code=409, detail="The day is still being processed; try again")
 
-    completions.append(body.member)
-    row = await db.update_group(group_id, completions_today=completions)
-    return db.row_to_response(row)
+    # Not applied but already completed — idempotent
+    return group_response(db.row_to_group(row))
 
 
 @app.post("/groups/{group_id}/select_build", response_model=GroupResponse)
@@ -132,46 +333,42 @@ async def select_build(group_id: str, body: SelectBuild):
     if body.type not in BUILDING_DAYS:
         raise HTTPException(status_code=400, detail=f"Invalid building type. Must be one of: {list(BUILDING_DAYS.keys())}")
 
-    row = await db.get_group_by_id(group_id)
+    new_build = {
+        "type": body.type,
+        "days_required": BUILDING_DAYS[body.type],
+        "days_completed": 0,
+    }
+    row = await db.set_build_if_none(group_id, body.member, new_build)
     if not row:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    # Run day processing first
-    if needs_day_processing(row["goal_reset_time"], row["last_processed_date"]):
+    # Day rolled over since the last write — process it, then retry
+    if not row["applied"] and needs_day_processing(row["next_reset_at"]):
         await maybe_process_day(row)
-        row = await db.get_group_by_id(group_id)
-
-    current_build = row["current_build"]
-    if isinstance(current_build, str):
-        current_build = json.loads(current_build)
+        row = await db.set_build_if_none(group_id, body.member, new_build)
+        if not row:
+            raise HTTPException(status_code=404, detail="Group not found")
+
+    if not row["applied"]:
+        if row["current_build"] is None and row["free_tiles"] and body.member in row["group_members"]:
+            # A concurrent build can commit after this statement's snapshot,
+            # leaving the row it returned without it; look again
+            row = await db.get_group_by_id(group_id)
+            if not row:
+                raise HTTPException(status_code=404, detail="Group not found")
 
-    if current_build is not None:
-        raise HTTPException(status_code=400, detail="A build is already in progress")
+        if row["current_build"] is not None:
+            raise HTTPException(status_code=400, detail="A build is already in progress")
 
-    city_map = row["city_map"]
-    if isinstance(city_map, str):
-        city_map = json.loads(city_map)
+        if not row["free_tiles"]:
+            raise HTTPException(status_code=400, detail="City is full — no empty tiles")
 
-    # Check if city is full
-    has_empty = any(
-        cell is None or cell == "rubble"
-        for r in city_map.values()
-        for cell in r
-    )
-    if not has_empty:
-        raise HTTPException(status_code=400, detail="City is full — no empty tiles")
+        if body.member not in row["group_members"]:
+            raise HTTPException(status_code=400, detail="Not a member of this group")
 
-    members = list(row["group_members"])
-    if body.member not in members:
-        raise HTTPException(status_code=400, detail="Not a member of this group")
+        raise HTTPException(status_code=409, detail="The day is still being processed; try again")
 
-    new_build = {
-        "type": body.type,
-        "days_required": BUILDING_DAYS[body.type],
-        "days_completed": 0,
-    }
-    row = await db.update_group(group_id, current_build=new_build)
-    return db.row_to_response(row)
+    return group_response(db.row_to_group(row))
 
 
 # --- Demo Endpoints ---
@@ -182,18 +379,14 @@ async def demo_asteroid(group_id: str):
     if not row:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    city_map = row["city_map"]
-    if isinstance(city_map, str):
-        city_map = json.loads(city_map)
+    city_map = db.city_of(row)
 
     # Check if there are any buildings to destroy
-    occupied = _find_occupied_tiles(city_map)
+    occupied = city_map.occupied_tiles()
     if not occupied:
         raise HTTPException(status_code=400, detail="No buildings on the map to destroy")
 
     current_build = row["current_build"]
-    if isinstance(current_build, str):
-        current_build = json.loads(current_build)
 
     # If no active build, inject a dummy so the asteroid branch fires
     if current_build is None:
@@ -207,8 +400,9 @@ async def demo_asteroid(group_id: str):
         streak=row["streak"],
     )
 
-    row = await db.update_group(group_id, **updates)
-    return db.row_to_response(row)
+    event = updates.get("pending_event")
+    row = await db.update_group(group_id, events=[event] if event else [], **updates)
+    return group_response(db.row_to_group(row))
 
 
 @app.post("/demo/{group_id}/fill_city", response_model=GroupResponse)
@@ -217,11 +411,9 @@ async def demo_fill_city(group_id: str, body: FillCity = FillCity()):
     if not row:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    city_map = row["city_map"]
-    if isinstance(city_map, str):
-        city_map = json.loads(city_map)
+    city_map = db.city_of(row)
 
-    empty = _find_empty_tiles(city_map)
+    empty = city_map.empty_tiles()
 
     if not empty:
         raise HTTPException(status_code=400, detail="City is full — no empty tiles")
@@ -232,12 +424,12 @@ async def demo_fill_city(group_id: str, body: FillCity = FillCity()):
         tiles_to_fill = empty
 
     building_types = ["house", "apartment", "skyscraper"]
-    new_map = {k: cells[:] for k, cells in city_map.items()}
+    new_map = city_map
     for r, c in tiles_to_fill:
-        new_map[str(r)][c] = random.choice(building_types)
+        new_map = new_map.with_tile(r, c, random.choice(building_types))
 
     row = await db.update_group(group_id, city_map=new_map)
-    return db.row_to_response(row)
+    return group_response(db.row_to_group(row))
 
 
 @app.delete("/groups/{group_id}", status_code=204)
@@ -247,25 +439,46 @@ async def delete_group(group_id: str):
         raise HTTPException(status_code=404, detail="Group not found")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.websocket("/groups/{group_id}/feed")
 async def group_feed(websocket: WebSocket, group_id: str):
     await websocket.accept()
+    metrics.WEBSOCKETS.inc()
 
-    import asyncio
+    # A snapshot on connect, then a delta whenever the row changes (see feed.py).
+    # Any client message asks for a fresh snapshot.
+    changes = notifications.subscribe(group_id)
+    receive = asyncio.ensure_future(websocket.receive_text())
+    sent: tuple[int, dict] | None = None
     try:
         while True:
-            # Check for client message (non-blocking) or wait 30s
-            try:
-                await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-            except asyncio.TimeoutError:
-                pass
-
-            row = await db.get_group_by_id(group_id)
-            if not row:
+            loaded = await load_group_versioned(group_id)
+            if loaded is None:
                 await websocket.close(code=4004, reason="Group not found")
                 return
 
-            resp = await maybe_process_day(row)
-            await websocket.send_text(resp.model_dump_json())
+            version, group = loaded
+            if sent is None:
+                await websocket.send_text(feed.snapshot(version, group))
+                sent = loaded
+            elif version != sent[0]:
+                await websocket.send_text(feed.delta(sent[0], sent[1], version, group))
+                sent = loaded
+
+            changed = asyncio.ensure_future(changes.get())
+            done, _ = await asyncio.wait({receive, changed}, return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if receive in done:
+                receive.result()  # raises WebSocketDisconnect once the client is gone
+                receive = asyncio.ensure_future(websocket.receive_text())
+                sent = None
     except WebSocketDisconnect:
         pass
+    finally:
+        receive.cancel()
+        notifications.unsubscribe(group_id, changes)
+        metrics.WEBSOCKETS.dec()
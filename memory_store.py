@@ -0,0 +1,298 @@
+"""
+In-process storage backend: the database.py interface over plain dicts.
+
+Selected with STORAGE_BACKEND=memory (see storage.py), for load tests and
+fuzzing without Postgres. Rows are dicts with the same columns as the groups
+table, so database.row_to_group and the rest of the app treat them like
+asyncpg Records. Every operation runs without awaiting, so each one is atomic
+on the event loop, the way each statement is in Postgres. Writes bump the row
+version and announce it through notifications.publish, standing in for the
+version and notify triggers. Nothing is persisted.
+"""
+import os
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import cache
+import group_codes
+import notifications
+from database import RANKED_COLUMNS, city_columns, city_of, dumps, loads, row_to_group  # noqa: F401 (part of the interface)
+from game_logic import GRID_COLS, GRID_ROWS
+
+_groups: dict[str, dict] = {}
+_codes: dict[str, str] = {}
+_events: dict[str, list[dict]] = {}
+_event_seq = 0
+# group_id -> (row, events) moved out by archive_inactive
+_archive: dict[str, tuple[dict, list[dict]]] = {}
+
+_code_key = os.urandom(32)
+_code_counter = 0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _row(group_id: str) -> dict | None:
+    """The stored row, moved back from the archive if it was there."""
+    row = _groups.get(group_id)
+    if row is None and group_id in _archive:
+        row, events = _archive.pop(group_id)
+        row = _groups[group_id] = {**row, "last_active_at": _now()}
+        if events:
+            _events[group_id] = events
+    return row
+
+
+def _day_processed(row: dict) -> bool:
+    return row["next_reset_at"] > _now()
+
+
+def _write(row: dict, **columns) -> dict:
+    """Replace the stored row with an updated copy, as the triggers would see it."""
+    row = {**row, **columns, "version": row["version"] + 1}
+    row["buildings"] = row["houses"] + row["apartments"] + row["skyscrapers"]
+    _groups[row["group_id"]] = row
+    notifications.publish(row["group_id"], row["version"])
+    return dict(row)
+
+
+def _mutate_or_fetch(row: dict | None, allowed: bool, **columns) -> dict | None:
+    if row is None:
+        return None
+    if not allowed:
+        return {**row, "applied": False}
+    return {**_write(row, **columns), "applied": True}
+
+
+def _log_events(group_id: str, events):
+    global _event_seq
+    log = _events.setdefault(group_id, [])
+    for event in events:
+        _event_seq += 1
+        log.append({"seq": _event_seq, "event": event})
+
+
+async def init_pool():
+    pass
+
+
+async def close_pool():
+    pass
+
+
+def pool_stats() -> dict:
+    return {}
+
+
+def statement_stats() -> dict:
+    return {"named": {}, "dynamic": 0, "dynamic_shapes": 0}
+
+
+async def create_group(
+    group_name: str, member: str, daily_goal: str, goal_reset_time: str,
+    grid_rows: int = GRID_ROWS, grid_cols: int = GRID_COLS,
+) -> dict:
+    global _code_counter
+    group_code = group_codes.code_for(_code_key, _code_counter)
+    _code_counter += 1
+
+    now = _now()
+    row = {
+        "group_id": str(uuid.uuid4()),
+        "group_code": group_code,
+        "group_name": group_name,
+        "group_members": [member],
+        "daily_goal": daily_goal,
+        "goal_reset_time": goal_reset_time,
+        "completions_today": [],
+        "streak": 0,
+        "current_build": None,
+        "city_bits": b"",
+        "grid_rows": grid_rows,
+        "grid_cols": grid_cols,
+        "free_tiles": grid_rows * grid_cols,
+        "last_processed_date": None,
+        "pending_event": None,
+        "created_at": now,
+        "version": 0,
+        "next_reset_at": now,
+        "last_active_at": now,
+        "houses": 0,
+        "apartments": 0,
+        "skyscrapers": 0,
+        "rubble": 0,
+        "buildings": 0,
+        "best_streak": 0,
+        "total_days_completed": 0,
+    }
+    _groups[row["group_id"]] = row
+    _codes[group_code] = row["group_id"]
+    return row_to_group(row)
+
+
+async def get_group_by_id(group_id: str) -> dict | None:
+    row = _row(group_id)
+    return dict(row) if row else None
+
+
+async def get_group_version(group_id: str) -> dict | None:
+    row = _row(group_id)
+    return {"version": row["version"], "next_reset_at": row["next_reset_at"]} if row else None
+
+
+async def get_groups_by_ids(group_ids: list[str]) -> list[dict]:
+    rows = (_row(gid) for gid in dict.fromkeys(group_ids))
+    return [dict(row) for row in rows if row]
+
+
+async def get_groups_by_member(member: str) -> list[dict]:
+    # Archived groups are listed without moving them back, as in Postgres
+    rows = sorted(
+        (row for row in [*_groups.values(), *(row for row, _ in _archive.values())] if member in row["group_members"]),
+        key=lambda r: r["created_at"],
+    )
+    return [
+        {key: row[key] for key in ("group_id", "group_code", "group_name", "group_members", "streak", "current_build")}
+        for row in rows
+    ]
+
+
+async def get_group_by_code(group_code: str) -> dict | None:
+    group_id = _codes.get(group_code.upper())
+    return await get_group_by_id(group_id) if group_id else None
+
+
+async def update_group(group_id: str, events: list[dict] = (), **fields) -> dict | None:
+    row = _groups.get(group_id)
+    if row is None:
+        return None
+    city = fields.pop("city_map", None)
+    if city is not None:
+        fields["city_bits"] = city.to_bytes()
+        fields.update(city_columns(city))
+    row = _write(row, **fields)
+    _log_events(group_id, events)
+    return row
+
+
+async def add_completion(group_id: str, member: str) -> dict | None:
+    row = _row(group_id)
+    return _mutate_or_fetch(
+        row,
+        row is not None
+        and member in row["group_members"]
+        and member not in row["completions_today"]
+        and _day_processed(row),
+        completions_today=row and [*row["completions_today"], member],
+        last_active_at=_now(),
+    )
+
+
+async def add_member(group_code: str, member: str, max_members: int) -> dict | None:
+    row = _row(_codes.get(group_code.upper(), ""))
+    return _mutate_or_fetch(
+        row,
+        row is not None
+        and member not in row["group_members"]
+        and len(row["group_members"]) < max_members,
+        group_members=row and [*row["group_members"], member],
+        last_active_at=_now(),
+    )
+
+
+async def set_build_if_none(group_id: str, member: str, build: dict) -> dict | None:
+    row = _row(group_id)
+    return _mutate_or_fetch(
+        row,
+        row is not None
+        and row["current_build"] is None
+        and member in row["group_members"]
+        and row["free_tiles"] > 0
+        and _day_processed(row),
+        current_build=build,
+        last_active_at=_now(),
+    )
+
+
+async def fetch_due_groups(limit: int) -> list[dict]:
+    now = _now()
+    due = sorted((row for row in _groups.values() if row["next_reset_at"] <= now), key=lambda r: r["next_reset_at"])
+    return [dict(row) for row in due[:limit]]
+
+
+async def make_due(group_ids: list[str]):
+    for group_id in group_ids:
+        row = _groups.get(group_id)
+        if row is not None:
+            processed = row["last_processed_date"]
+            if processed:
+                processed = (date.fromisoformat(processed) - timedelta(days=1)).isoformat()
+            _write(row, next_reset_at=_now(), last_processed_date=processed)
+
+
+async def write_day_results(results: list[dict]) -> list[dict]:
+    written = []
+    for r in results:
+        row = _groups.get(r["group_id"])
+        if row is None or row["last_processed_date"] == r["last_processed_date"] or row["version"] != r["version"]:
+            continue
+        written.append(_write(
+            row,
+            completions_today=[],
+            streak=r["streak"],
+            best_streak=max(row["best_streak"], r["best_streak"]),
+            total_days_completed=row["total_days_completed"] + r["completed_days"],
+            current_build=r["current_build"],
+            city_bits=r["city_map"].to_bytes(),
+            **city_columns(r["city_map"]),
+            pending_event=r["pending_event"],
+            last_processed_date=r["last_processed_date"],
+            next_reset_at=r["next_reset_at"],
+        ))
+        _log_events(r["group_id"], r.get("events", ()))
+    return written
+
+
+async def fetch_events(group_id: str, after: int, limit: int) -> list[dict]:
+    log = _events.get(group_id, [])
+    return [entry for entry in log if entry["seq"] > after][:limit]
+
+
+async def delete_group(group_id: str) -> bool:
+    row = _groups.pop(group_id, None)
+    if row is None and group_id in _archive:
+        row, _ = _archive.pop(group_id)
+    if row is None:
+        return False
+    del _codes[row["group_code"]]
+    _events.pop(group_id, None)
+    cache.invalidate(group_id)
+    notifications.publish(group_id)
+    return True
+
+
+async def archive_inactive(idle: timedelta, limit: int) -> int:
+    """Set aside groups nobody acted on for idle, longest idle first. They aren't compressed here."""
+    cutoff = _now() - idle
+    idle_rows = sorted(
+        (row for row in _groups.values() if row["last_active_at"] < cutoff), key=lambda r: r["last_active_at"],
+    )[:limit]
+    for row in idle_rows:
+        group_id = row["group_id"]
+        _archive[group_id] = (_groups.pop(group_id), _events.pop(group_id, []))
+        notifications.publish(group_id)
+    return len(idle_rows)
+
+
+async def top_groups(column: str, limit: int) -> list[dict]:
+    if column not in RANKED_COLUMNS:
+        raise ValueError(f"Not a ranked column: {column}")
+    rows = sorted(_groups.values(), key=lambda r: r["group_id"])
+    rows.sort(key=lambda r: r[column], reverse=True)
+    return [
+        {key: row[key] for key in ("group_id", "group_name", "houses", "apartments", "skyscrapers", "rubble",
+                                   "buildings", "best_streak", "total_days_completed")}
+        for row in rows[:limit]
+    ]
@@ -0,0 +1,200 @@
+import bisect
+import functools
+import inspect
+import time
+from typing import Callable
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry: list = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def lines(self):
+        for values, total in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {total}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+        _registry.append(self)
+
+    def observe(self, seconds: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def lines(self):
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}"
+
+
+class Collected:
+    """A metric read from elsewhere at scrape time: collect() returns {label values: value}."""
+
+    def __init__(self, name: str, help: str, kind: str, labels: tuple[str, ...], collect: Callable[[], dict]):
+        self.name, self.help, self.kind, self.labels = name, help, kind, labels
+        self.collect = collect
+        _registry.append(self)
+
+    def lines(self):
+        for values, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {value}"
+
+
+def render() -> str:
+    out = []
+    for metric in _registry:
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.lines())
+    return "\n".join(out) + "\n"
+
+
+# --- Application metrics ---
+
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"),
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "database.py call latency, including pool wait.", ("query",),
+)
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_acquire_wait_seconds", "Time spent waiting for a pool connection.",
+)
+DAY_PROCESSING_SECONDS = Histogram(
+    "day_processing_duration_seconds", "process_end_of_day CPU time per group.",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+DAY_PROCESSING = Counter(
+    "day_processing_total", "End-of-day runs by outcome.", ("outcome",),
+)
+GROUP_ARCHIVE_MOVES = Counter(
+    "group_archive_moves_total", "Groups moved into (archived) or out of (rehydrated) groups_archive.", ("direction",),
+)
+WEBSOCKETS = Gauge(
+    "websocket_connections", "Open group feed sockets.",
+)
+WEBSOCKETS.set(0)
+
+
+def timed(histogram: Histogram):
+    """Observe each call's duration in histogram, labelled with the function name."""
+    def decorator(fn):
+        name = fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, name)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+def day_processing(fn):
+    """Time process_end_of_day and count its outcomes."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        updates = fn(*args, **kwargs)
+        DAY_PROCESSING_SECONDS.observe(time.perf_counter() - start)
+        event = updates.get("pending_event")
+        if event:
+            outcome = event["type"]
+        elif updates.get("current_build"):
+            outcome = "progress"
+        else:
+            outcome = "no_op"
+        DAY_PROCESSING.inc(outcome)
+        return updates
+    return wrapper
+
+
+class TimingMiddleware:
+    """ASGI middleware recording HTTP_SECONDS by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_SECONDS.observe(
+                time.perf_counter() - start,
+                scope["method"], route.path if route else "unmatched", status,
+            )
@@ -1,7 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
+from game_logic import GRID_COLS, GRID_ROWS, MAX_GRID_SIDE
+
 
 # --- Request Models ---
 
@@ -10,6 +12,8 @@ class CreateGroup(BaseModel):
     member: str
     daily_goal: str
     goal_reset_time: str = "00:00"  # HH:MM UTC
+    grid_rows: int = Field(GRID_ROWS, ge=1, le=MAX_GRID_SIDE)
+    grid_cols: int = Field(GRID_COLS, ge=1, le=MAX_GRID_SIDE)
 
 
 class JoinGroup(BaseModel):
@@ -26,6 +30,10 @@ class SelectBuild(BaseModel):
     type: str  # "house" | "apartment" | "skyscraper"
 
 
+class GroupIds(BaseModel):
+    ids: list[str]
+
+
 class FillCity(BaseModel):
     count: Optional[int] = None  # how many tiles to fill; None = all empty
 
@@ -63,3 +71,40 @@ class GroupResponse(BaseModel):
     last_processed_date: Optional[str] = None
     pending_event: Optional[PendingEvent] = None
     created_at: str
+
+
+class GroupSummary(BaseModel):
+    group_id: str
+    group_code: str
+    group_name: str
+    group_members: list[str]
+    streak: int
+    current_build: Optional[CurrentBuild] = None
+
+
+class GroupEvent(PendingEvent):
+    seq: int
+
+
+class EventPage(BaseModel):
+    events: list[GroupEvent]
+    cursor: int  # pass as ?after= to get the next page
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    group_id: str
+    group_name: str
+    houses: int
+    apartments: int
+    skyscrapers: int
+    rubble: int
+    buildings: int
+    best_streak: int
+    total_days_completed: int
+
+
+class Leaderboard(BaseModel):
+    board: str
+    generated_at: str
+    entries: list[LeaderboardEntry]
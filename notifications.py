@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+
+import asyncpg
+
+import cache
+
+log = logging.getLogger(__name__)
+
+# Fed by the groups_notify_change trigger (see database.CREATE_TABLE)
+CHANNEL = "group_changes"
+
+RECONNECT_DELAY_SECONDS = 1.0
+
+_conn: asyncpg.Connection | None = None
+_reconnect_task: asyncio.Task | None = None
+_subscribers: dict[str, set[asyncio.Queue]] = {}
+
+
+async def start():
+    """Open the single LISTEN connection for this process."""
+    global _conn
+    _conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    _conn.add_termination_listener(_on_terminated)
+    await _conn.add_listener(CHANNEL, _on_notify)
+
+
+async def stop():
+    global _conn, _reconnect_task
+    if _reconnect_task:
+        _reconnect_task.cancel()
+        _reconnect_task = None
+    if _conn:
+        conn, _conn = _conn, None
+        await conn.close()
+
+
+def subscribe(group_id: str) -> asyncio.Queue:
+    """
+    Get a queue that receives the group_id whenever the group changes.
+    The cache has already been invalidated by the time it arrives.
+    Holds at most one pending wake-up: subscribers re-read the latest state,
+    so bursts of changes collapse into one.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    _subscribers.setdefault(group_id, set()).add(queue)
+    return queue
+
+
+def unsubscribe(group_id: str, queue: asyncio.Queue):
+    queues = _subscribers.get(group_id)
+    if queues is None:
+        return
+    queues.discard(queue)
+    if not queues:
+        del _subscribers[group_id]
+
+
+def _wake(group_id: str):
+    for queue in _subscribers.get(group_id, ()):
+        if not queue.full():
+            queue.put_nowait(group_id)
+
+
+def publish(group_id: str, version: int | None = None):
+    """A group changed (None version: it was deleted). Invalidate it and wake its subscribers."""
+    cache.invalidate(group_id, version)
+    _wake(group_id)
+
+
+def _on_notify(conn, pid, channel, payload):
+    # "group_id:version" for updates, bare "group_id" for deletes
+    group_id, _, version = payload.partition(":")
+    publish(group_id, int(version) if version else None)
+
+
+def _on_terminated(conn):
+    global _reconnect_task
+    if conn is _conn:
+        _reconnect_task = asyncio.get_running_loop().create_task(_reconnect())
+
+
+async def _reconnect():
+    while True:
+        await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+        try:
+            await start()
+        except (OSError, asyncpg.PostgresError):
+            log.warning("Reconnecting %s listener failed, retrying", CHANNEL)
+            continue
+        # Anything could have changed while we weren't listening
+        cache.clear()
+        for group_id in list(_subscribers):
+            _wake(group_id)
+        return
@@ -0,0 +1,252 @@
+"""
+Vectorized end-of-day engine for balancing and bulk simulation.
+
+Advances a whole batch of groups one day at a time with NumPy, following the
+same rules as game_logic.process_end_of_day. Each group gets DRAWS_PER_DAY
+uniforms per day, consumed in the same order the scalar function consumes
+rng.random(), so feeding those uniforms to the scalar function reproduces the
+batch result exactly (see --verify).
+
+    python simulate.py --groups 1000000 --days 30 --seed 1
+
+NumPy is only needed here, not by the API.
+"""
+import argparse
+import json
+import random
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from game_logic import (
+    BUILDING_DAYS, DESTROY_WEIGHTS, GRID_COLS, GRID_ROWS, TILE_BITS, TILE_CODES, TILE_TYPES,
+    CityMap, process_end_of_day,
+)
+
+TILES = GRID_ROWS * GRID_COLS
+# 1 for the tile or asteroid size, then up to 3 destroyed buildings
+DRAWS_PER_DAY = 4
+
+RUBBLE = TILE_CODES["rubble"]
+
+# Lookups indexed by tile / build code
+_DAYS_REQUIRED = np.zeros(8, dtype=np.int16)
+_WEIGHTS = np.zeros(8, dtype=np.int64)
+for _kind, _days in BUILDING_DAYS.items():
+    _DAYS_REQUIRED[TILE_CODES[_kind]] = _days
+    _WEIGHTS[TILE_CODES[_kind]] = DESTROY_WEIGHTS.get(_kind, 1)
+
+_SHIFTS = (np.arange(TILES, dtype=np.uint64) * np.uint64(TILE_BITS))
+
+# Outcome codes returned by advance_day
+IDLE, PROGRESS, BUILD_COMPLETE, ASTEROID = 0, 1, 2, 3
+OUTCOMES = {IDLE: "idle", PROGRESS: "progress", BUILD_COMPLETE: "build_complete", ASTEROID: "asteroid"}
+
+
+@dataclass
+class GroupBatch:
+    """State of N groups as parallel arrays. Members are bits of member_mask."""
+    member_mask: np.ndarray     # uint8, bit i set = member i exists
+    done_mask: np.ndarray       # uint8, bit i set = member i completed today
+    build_type: np.ndarray      # int8, 0 = no build, else the building's tile code
+    days_completed: np.ndarray  # int16
+    streak: np.ndarray          # int32
+    city_bits: np.ndarray       # uint64, CityMap.bits
+
+    def __len__(self) -> int:
+        return len(self.member_mask)
+
+    @classmethod
+    def empty(cls, n: int, members: np.ndarray) -> "GroupBatch":
+        return cls(
+            member_mask=((1 << members) - 1).astype(np.uint8),
+            done_mask=np.zeros(n, dtype=np.uint8),
+            build_type=np.zeros(n, dtype=np.int8),
+            days_completed=np.zeros(n, dtype=np.int16),
+            streak=np.zeros(n, dtype=np.int32),
+            city_bits=np.zeros(n, dtype=np.uint64),
+        )
+
+
+def unpack_tiles(city_bits: np.ndarray) -> np.ndarray:
+    """(N,) packed maps -> (N, TILES) int8 tile codes, row-major."""
+    return ((city_bits[:, None] >> _SHIFTS) & np.uint64(0b111)).astype(np.int8)
+
+
+def pack_tiles(tiles: np.ndarray) -> np.ndarray:
+    return np.bitwise_or.reduce(tiles.astype(np.uint64) << _SHIFTS, axis=1)
+
+
+def _first_above(cumulative: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """Per row, the first column whose cumulative value exceeds target."""
+    return np.argmax(cumulative > target[:, None], axis=1)
+
+
+def advance_day(batch: GroupBatch, draws: np.ndarray) -> np.ndarray:
+    """
+    Run end-of-day processing for every group in place.
+    draws is (N, DRAWS_PER_DAY) uniforms in [0, 1). Returns per-group outcome codes.
+    """
+    n = len(batch)
+    rows = np.arange(n)
+    tiles = unpack_tiles(batch.city_bits)
+    occupied = (tiles & 0b11) != 0
+    outcome = np.full(n, IDLE, dtype=np.int8)
+
+    has_build = batch.build_type > 0
+    all_done = (batch.done_mask & batch.member_mask) == batch.member_mask
+    success = has_build & all_done
+    failed = has_build & ~all_done
+
+    new_days = batch.days_completed + 1
+    finished = success & (new_days >= _DAYS_REQUIRED[batch.build_type])
+    progress = success & ~finished
+
+    # Building complete — k-th free tile, row-major
+    free = ~occupied
+    n_free = free.sum(axis=1)
+    place = finished & (n_free > 0)
+    k = np.floor(draws[:, 0] * n_free)
+    tile = _first_above(np.cumsum(free, axis=1), k)
+    tiles[rows[place], tile[place]] = batch.build_type[place]
+    outcome[place] = BUILD_COMPLETE
+
+    # Asteroid — 1-3 weighted picks without replacement, leaving one standing
+    n_occupied = occupied.sum(axis=1)
+    max_destroy = np.minimum(3, n_occupied - 1)
+    hit = failed & (max_destroy > 0)
+    n_destroy = np.where(hit, 1 + np.floor(draws[:, 0] * np.maximum(max_destroy, 0)), 0)
+    weights = np.where(occupied, _WEIGHTS[tiles], 0)
+    for j in range(3):
+        pick = hit & (n_destroy > j)
+        if not pick.any():
+            break
+        target = draws[:, 1 + j] * weights.sum(axis=1)
+        tile = _first_above(np.cumsum(weights, axis=1), target)
+        tiles[rows[pick], tile[pick]] = RUBBLE
+        weights[rows[pick], tile[pick]] = 0
+    outcome[hit] = ASTEROID
+
+    outcome[progress] = PROGRESS
+    batch.days_completed = np.where(progress, new_days, 0).astype(np.int16)
+    batch.streak = np.where(progress, batch.streak + 1, np.where(has_build, 0, batch.streak)).astype(np.int32)
+    batch.build_type = np.where(progress, batch.build_type, 0).astype(np.int8)
+    batch.done_mask = np.zeros(n, dtype=np.uint8)
+    batch.city_bits = pack_tiles(tiles)
+    return outcome
+
+
+# --- Scalar cross-check ---
+
+class _Draws(random.Random):
+    """Replays a fixed row of uniforms through the random.Random interface."""
+
+    def __init__(self, values):
+        super().__init__()
+        self._values = iter(values)
+
+    def random(self) -> float:
+        return float(next(self._values))
+
+
+def _scalar_args(batch: GroupBatch, g: int) -> dict:
+    members = [f"m{i}" for i in range(8) if batch.member_mask[g] >> i & 1]
+    done = [f"m{i}" for i in range(8) if batch.done_mask[g] >> i & 1]
+    build = None
+    if batch.build_type[g]:
+        kind = TILE_TYPES[int(batch.build_type[g])]
+        build = {"type": kind, "days_required": BUILDING_DAYS[kind], "days_completed": int(batch.days_completed[g])}
+    return {
+        "group_members": members,
+        "completions_today": done,
+        "current_build": build,
+        "city_map": CityMap(int(batch.city_bits[g])),
+        "streak": int(batch.streak[g]),
+    }
+
+
+def verify(before: dict, after: GroupBatch, g: int, draws: np.ndarray):
+    """Assert process_end_of_day, fed the same draws, lands where the batch did."""
+    updates = process_end_of_day(**before, rng=_Draws(draws[g]))
+    city = updates.get("city_map", before["city_map"])
+    build = updates.get("current_build", before["current_build"])
+    expected = (
+        city.bits,
+        updates.get("streak", before["streak"]),
+        TILE_CODES[build["type"]] if build else 0,
+        build["days_completed"] if build else 0,
+    )
+    actual = (int(after.city_bits[g]), int(after.streak[g]), int(after.build_type[g]), int(after.days_completed[g]))
+    assert expected == actual, f"group {g}: scalar {expected} != batch {actual}"
+
+
+# --- CLI ---
+
+def _start_day(batch: GroupBatch, rng: np.random.Generator, completion_rate: float, build_mix: np.ndarray):
+    """Members complete independently; idle groups with room pick a new build."""
+    n = len(batch)
+    completed = rng.random((n, 4)) < completion_rate
+    batch.done_mask = (completed * (1 << np.arange(4))).sum(axis=1).astype(np.uint8) & batch.member_mask
+
+    has_room = ((unpack_tiles(batch.city_bits) & 0b11) == 0).any(axis=1)
+    picking = (batch.build_type == 0) & has_room
+    choice = rng.choice(len(build_mix), size=n, p=build_mix) + 1
+    batch.build_type = np.where(picking, choice, batch.build_type).astype(np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--completion-rate", type=float, default=0.9, help="chance each member completes each day")
+    parser.add_argument("--build-mix", default="0.5,0.3,0.2", help="house,apartment,skyscraper pick probabilities")
+    parser.add_argument("--chunk", type=int, default=250_000, help="groups advanced per NumPy call")
+    parser.add_argument("--verify", type=int, default=0, help="cross-check this many groups per chunk-day against the scalar function")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    build_mix = np.array([float(p) for p in args.build_mix.split(",")])
+    build_mix /= build_mix.sum()
+
+    totals = np.zeros(len(OUTCOMES), dtype=np.int64)
+    composition = np.zeros(8, dtype=np.int64)
+    verified = 0
+    elapsed = 0.0
+
+    for start in range(0, args.groups, args.chunk):
+        n = min(args.chunk, args.groups - start)
+        batch = GroupBatch.empty(n, rng.integers(1, 5, size=n))
+        for _ in range(args.days):
+            _start_day(batch, rng, args.completion_rate, build_mix)
+            draws = rng.random((n, DRAWS_PER_DAY))
+            sample = rng.choice(n, size=min(args.verify, n), replace=False)
+            before = {int(g): _scalar_args(batch, int(g)) for g in sample}
+
+            t0 = time.perf_counter()
+            outcome = advance_day(batch, draws)
+            elapsed += time.perf_counter() - t0
+
+            for g, args_g in before.items():
+                verify(args_g, batch, g, draws)
+            verified += len(before)
+            totals += np.bincount(outcome, minlength=len(OUTCOMES))
+        composition += np.bincount(unpack_tiles(batch.city_bits).ravel(), minlength=8)
+
+    group_days = args.groups * args.days
+    print(json.dumps({
+        "group_days": group_days,
+        "seconds": round(elapsed, 3),
+        "group_days_per_second": round(group_days / elapsed) if elapsed else None,
+        "outcomes": {name: int(totals[code]) for code, name in OUTCOMES.items()},
+        "final_tiles_per_city": {
+            (TILE_TYPES[code] or "empty"): round(int(composition[code]) / args.groups, 3)
+            for code in TILE_TYPES
+        },
+        "verified_group_days": verified,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
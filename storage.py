@@ -0,0 +1,59 @@
+"""
+The storage backend the app runs against, picked by STORAGE_BACKEND:
+
+    postgres  database.py, against DATABASE_URL (the default)
+    memory    memory_store.py, dicts in this process; nothing is persisted
+
+Both implement Storage. Rows come back as mappings with the groups table's
+columns, which row_to_group and city_of turn into responses.
+"""
+import os
+from collections.abc import Mapping
+from datetime import timedelta
+from typing import Protocol
+
+import database
+import memory_store
+from game_logic import CityMap
+
+BACKEND = os.environ.get("STORAGE_BACKEND", "postgres")
+
+
+class Storage(Protocol):
+    async def init_pool(self): ...
+    async def close_pool(self): ...
+    def pool_stats(self) -> dict: ...
+    def statement_stats(self) -> dict: ...
+
+    def dumps(self, obj) -> bytes: ...
+    def city_of(self, row: Mapping) -> CityMap: ...
+    def row_to_group(self, row: Mapping) -> dict: ...
+
+    async def create_group(
+        self, group_name: str, member: str, daily_goal: str, goal_reset_time: str,
+        grid_rows: int = ..., grid_cols: int = ...,
+    ) -> dict: ...
+    async def get_group_by_id(self, group_id: str) -> Mapping | None: ...
+    async def get_group_version(self, group_id: str) -> Mapping | None: ...
+    async def get_groups_by_ids(self, group_ids: list[str]) -> list[Mapping]: ...
+    async def get_groups_by_member(self, member: str) -> list[Mapping]: ...
+    async def get_group_by_code(self, group_code: str) -> Mapping | None: ...
+    async def update_group(self, group_id: str, events: list[dict] = ..., **fields) -> Mapping | None: ...
+    async def add_completion(self, group_id: str, member: str) -> Mapping | None: ...
+    async def add_member(self, group_code: str, member: str, max_members: int) -> Mapping | None: ...
+    async def set_build_if_none(self, group_id: str, member: str, build: dict) -> Mapping | None: ...
+    async def fetch_due_groups(self, limit: int) -> list[Mapping]: ...
+    async def make_due(self, group_ids: list[str]): ...
+    async def write_day_results(self, results: list[dict]) -> list[Mapping]: ...
+    async def fetch_events(self, group_id: str, after: int, limit: int) -> list[Mapping]: ...
+    async def delete_group(self, group_id: str) -> bool: ...
+    async def archive_inactive(self, idle: timedelta, limit: int) -> int: ...
+    async def top_groups(self, column: str, limit: int) -> list[Mapping]: ...
+
+
+if BACKEND == "memory":
+    backend: Storage = memory_store
+elif BACKEND == "postgres":
+    backend: Storage = database
+else:
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {BACKEND!r} (expected postgres or memory)")
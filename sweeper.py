@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+from game_logic import catch_up, get_processing_date, next_reset_at
+from storage import backend as db
+
+log = logging.getLogger(__name__)
+
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("SWEEP_INTERVAL_SECONDS", "30"))
+SWEEP_PAGE_SIZE = int(os.environ.get("SWEEP_PAGE_SIZE", "500"))
+
+# Groups with no member action (complete, join, build) for this long move to
+# the archive; 0 turns archiving off
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+
+
+def rollover(row, processing_date: str) -> dict:
+    """
+    Run end-of-day logic for every period the row missed and return its full
+    post-rollover state, plus the events produced along the way. The state
+    only applies to the row's version; write_day_results skips it otherwise.
+    """
+    city_map = db.city_of(row)
+    updates, events = catch_up(
+        group_id=row["group_id"],
+        group_members=list(row["group_members"]),
+        completions_today=list(row["completions_today"]),
+        current_build=row["current_build"],
+        city_map=city_map,
+        streak=row["streak"],
+        goal_reset_time=row["goal_reset_time"],
+        last_processed_date=row["last_processed_date"],
+        processing_date=processing_date,
+    )
+    return {
+        "group_id": row["group_id"],
+        "streak": updates.get("streak", row["streak"]),
+        "best_streak": updates["best_streak"],
+        "completed_days": updates["completed_days"],
+        "current_build": updates.get("current_build", row["current_build"]),
+        "city_map": updates.get("city_map", city_map),
+        "pending_event": updates.get("pending_event", row["pending_event"]),
+        "last_processed_date": processing_date,
+        "next_reset_at": next_reset_at(row["goal_reset_time"], processing_date),
+        "version": row["version"],
+        "events": events,
+    }
+
+
+async def sweep_once() -> int:
+    """Roll over every due group, a page at a time."""
+    written = 0
+    while True:
+        rows = await db.fetch_due_groups(SWEEP_PAGE_SIZE)
+        if not rows:
+            return written
+        results = [rollover(row, get_processing_date(row["goal_reset_time"])) for row in rows]
+        page_written = len(await db.write_day_results(results))
+        written += page_written
+        # A short page is the last one; a page that wrote nothing would repeat forever
+        if len(rows) < SWEEP_PAGE_SIZE or not page_written:
+            return written
+
+
+async def archive_once() -> int:
+    """Archive idle groups a batch (one transaction) at a time, until none are left."""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+    archived = 0
+    while True:
+        moved = await db.archive_inactive(timedelta(days=ARCHIVE_AFTER_DAYS), ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            return archived
+
+
+async def run_forever():
+    while True:
+        for job, name in ((sweep_once, "End-of-day sweep"), (archive_once, "Archiving")):
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("%s failed", name)
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,111 @@
+"""
+Checks for the bit-level code persisted data depends on: the packed CityMap
+(city_bits), the asteroid's weighted picks, and group code permutation.
+Each is compared against a plain reimplementation. Run with python -m pytest.
+"""
+import random
+
+import pytest
+
+import group_codes
+from game_logic import MAX_GRID_SIDE, TILE_CODES, CityMap, _Fenwick
+
+KINDS = list(TILE_CODES)
+SIZES = [(rows, cols) for rows in range(1, MAX_GRID_SIDE + 1) for cols in (1, 2, 5, 7, 13, MAX_GRID_SIDE)]
+
+
+def random_city(rng: random.Random, rows: int, cols: int) -> dict[str, list]:
+    fill = rng.random()
+    return {
+        str(r): [rng.choice(KINDS[1:]) if rng.random() < fill else None for _ in range(cols)]
+        for r in range(rows)
+    }
+
+
+@pytest.mark.parametrize("rows,cols", SIZES)
+def test_city_round_trips(rows, cols):
+    rng = random.Random(rows * 100 + cols)
+    for _ in range(20):
+        city_json = random_city(rng, rows, cols)
+        city = CityMap.from_json(city_json)
+        assert city.to_json() == city_json
+        assert CityMap.from_bytes(city.to_bytes(), rows, cols) == city
+        assert len(city.to_bytes()) == (rows * cols * 3 + 7) // 8
+
+
+@pytest.mark.parametrize("rows,cols", SIZES)
+def test_city_queries_match_a_scan(rows, cols):
+    rng = random.Random(rows * 100 + cols)
+    for _ in range(20):
+        city_json = random_city(rng, rows, cols)
+        city = CityMap.from_json(city_json)
+        tiles = [([r, c], city_json[str(r)][c]) for r in range(rows) for c in range(cols)]
+        free = [pos for pos, kind in tiles if kind in (None, "rubble")]
+
+        for kind in KINDS:
+            assert city.count(kind) == sum(k == kind for _, k in tiles)
+        assert city.free_count() == len(free)
+        assert city.empty_tiles() == free
+        assert [city.nth_free(k) for k in range(len(free))] == free
+        with pytest.raises(IndexError):
+            city.nth_free(len(free))
+        assert city.occupied_tiles() == [(r, c, kind) for (r, c), kind in tiles if [r, c] not in free]
+
+
+def test_with_tile_only_changes_that_tile():
+    rng = random.Random(0)
+    for rows, cols in SIZES:
+        city_json = random_city(rng, rows, cols)
+        r, c, kind = rng.randrange(rows), rng.randrange(cols), rng.choice(KINDS)
+        city_json_after = {**city_json, str(r): [*city_json[str(r)]]}
+        city_json_after[str(r)][c] = kind
+        assert CityMap.from_json(city_json).with_tile(r, c, kind).to_json() == city_json_after
+
+
+def test_fenwick_picks_match_choices():
+    # The asteroid used to draw with rng.choices over the tiles still standing;
+    # the Fenwick tree has to make the same picks from the same rng
+    for seed in range(500):
+        rng = random.Random(seed)
+        weights = [rng.choice((1, 2, 3)) for _ in range(rng.randint(1, 400))]
+        picks = min(3, len(weights))
+
+        expected_rng = random.Random(seed)
+        remaining, remaining_weights = list(range(len(weights))), weights[:]
+        expected = []
+        for _ in range(picks):
+            idx = expected_rng.choices(remaining, weights=remaining_weights, k=1)[0]
+            expected.append(idx)
+            pos = remaining.index(idx)
+            remaining.pop(pos)
+            remaining_weights.pop(pos)
+
+        tree_rng = random.Random(seed)
+        standing = _Fenwick(weights)
+        got = []
+        for _ in range(picks):
+            idx = standing.find(tree_rng.random() * standing.total)
+            standing.add(idx, -weights[idx])
+            got.append(idx)
+
+        assert got == expected
+
+
+def test_group_code_permutation():
+    key = bytes(range(32))
+    counters = [*range(5000), *range(group_codes.CODE_SPACE - 5000, group_codes.CODE_SPACE)]
+    codes = [group_codes.permute(key, n) for n in counters]
+    assert len(set(codes)) == len(codes)
+    assert all(0 <= n < group_codes.CODE_SPACE for n in codes)
+    assert codes == [group_codes.permute(key, n) for n in counters]
+    assert codes != [group_codes.permute(bytes(32), n) for n in counters]
+    with pytest.raises(ValueError):
+        group_codes.permute(key, group_codes.CODE_SPACE)
+
+
+def test_group_code_encoding():
+    base = len(group_codes.ALPHABET)
+    for n in [0, 1, base - 1, base, group_codes.CODE_SPACE - 1, *random.Random(0).sample(range(group_codes.CODE_SPACE), 1000)]:
+        code = group_codes.encode(n)
+        assert len(code) == group_codes.CODE_LENGTH
+        assert sum(group_codes.ALPHABET.index(ch) * base ** i for i, ch in enumerate(code)) == n
@@ -0,0 +1,154 @@
+"""
+catch_up: what a group that missed several resets wakes up to, and the
+leaderboard tallies it hands the rollover. No database; the write path runs
+against memory_store.
+"""
+import asyncio
+
+import game_logic
+import memory_store
+import sweeper
+from game_logic import CityMap, catch_up, next_reset_at
+
+MEMBERS = ["a", "b"]
+# Four houses along the top row, so an asteroid always has something to hit
+CITY = CityMap.from_json({
+    "0": ["house", "house", "house", "house", None],
+    "1": [None] * 5, "2": [None] * 5, "3": [None] * 5,
+})
+
+
+def run(**overrides) -> tuple[dict, list[dict]]:
+    args = {
+        "group_id": "g1",
+        "group_members": MEMBERS,
+        "completions_today": MEMBERS,
+        "current_build": {"type": "apartment", "days_required": 3, "days_completed": 1},
+        "city_map": CITY,
+        "streak": 1,
+        "goal_reset_time": "06:00",
+        "last_processed_date": "2026-03-01",
+        "processing_date": "2026-03-06",
+    }
+    return catch_up(**{**args, **overrides})
+
+
+def counting_periods(monkeypatch) -> list[int]:
+    calls = []
+    process = game_logic.process_end_of_day
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return process(*args, **kwargs)
+
+    monkeypatch.setattr(game_logic, "process_end_of_day", counted)
+    return calls
+
+
+def test_gap_progresses_then_asteroid_then_stops(monkeypatch):
+    periods = counting_periods(monkeypatch)
+    updates, events = run()
+
+    # 03-01 everyone completed: the apartment moves on. 03-02 nobody did: an
+    # asteroid ends the build, and the three periods after that change nothing
+    assert len(periods) == 2
+    assert updates["current_build"] is None
+    assert updates["streak"] == 0
+    assert updates["completions_today"] == []
+    assert [event["type"] for event in events] == ["asteroid"]
+    assert updates["pending_event"] == events[0]
+    assert events[0]["timestamp"] == next_reset_at("06:00", "2026-03-02").isoformat()
+
+    city = updates["city_map"]
+    destroyed = events[0]["tiles_destroyed"]
+    assert 1 <= len(destroyed) <= 3
+    assert city.count("rubble") == len(destroyed)
+    assert city.count("house") == 4 - len(destroyed)
+    assert all(city.get(r, c) == "rubble" for r, c in destroyed)
+
+
+def test_replay_is_identical():
+    first, second = run(), run()
+    assert first == second
+    assert [event["event_id"] for event in first[1]] == [event["event_id"] for event in second[1]]
+    # The ids come from the group and date, not from chance
+    other, _ = run(group_id="g2")
+    assert other["pending_event"]["event_id"] != first[0]["pending_event"]["event_id"]
+
+
+def test_first_rollover_closes_one_period(monkeypatch):
+    periods = counting_periods(monkeypatch)
+    updates, events = run(last_processed_date=None)
+
+    assert len(periods) == 1
+    assert updates["current_build"] == {"type": "apartment", "days_required": 3, "days_completed": 2}
+    assert updates["streak"] == 2
+    assert events == []
+
+
+def test_tallies():
+    # Progress to a streak of 2, then the asteroid
+    updates, _ = run()
+    assert (updates["best_streak"], updates["completed_days"]) == (2, 1)
+
+    # An asteroid straight away: the streak passed in is still the best
+    updates, _ = run(completions_today=["a"], streak=5)
+    assert (updates["best_streak"], updates["completed_days"]) == (5, 0)
+
+    # A finished build counts the day but resets the streak
+    updates, events = run(current_build={"type": "house", "days_required": 1, "days_completed": 0}, streak=0)
+    assert (updates["best_streak"], updates["completed_days"]) == (0, 1)
+    assert [event["type"] for event in events] == ["build_complete"]
+
+
+def test_split_catch_up_matches_one_pass():
+    # Closing a gap in two rollovers gives the same city, events and counters
+    # (as day_rollover folds them: GREATEST and +=) as closing it in one
+    build = {"type": "skyscraper", "days_required": 7, "days_completed": 0}
+    whole, whole_events = run(current_build=build, streak=0)
+    head, head_events = run(current_build=build, streak=0, processing_date="2026-03-02")
+    tail, tail_events = run(
+        completions_today=[],
+        current_build=head["current_build"],
+        city_map=head.get("city_map", CITY),
+        streak=head["streak"],
+        last_processed_date="2026-03-02",
+    )
+
+    assert head_events + tail_events == whole_events
+    assert tail["city_map"] == whole["city_map"]
+    assert max(head["best_streak"], tail["best_streak"]) == whole["best_streak"]
+    assert head["completed_days"] + tail["completed_days"] == whole["completed_days"]
+
+
+def test_rollover_writes_counters():
+    async def scenario():
+        group = await memory_store.create_group("tally", "a", "run", "06:00")
+        group_id = group["group_id"]
+        row = await memory_store.update_group(
+            group_id,
+            group_members=MEMBERS,
+            completions_today=MEMBERS,
+            current_build={"type": "apartment", "days_required": 3, "days_completed": 1},
+            city_map=CITY,
+            streak=1,
+            last_processed_date="2026-03-01",
+        )
+        assert (row["houses"], row["buildings"]) == (4, 4)
+
+        await memory_store.write_day_results([sweeper.rollover(row, "2026-03-06")])
+        row = await memory_store.get_group_by_id(group_id)
+        city = memory_store.city_of(row)
+        assert (row["best_streak"], row["total_days_completed"], row["streak"]) == (2, 1, 0)
+        assert (row["houses"], row["rubble"]) == (city.count("house"), city.count("rubble"))
+        assert row["buildings"] == row["houses"]
+
+        # A later period nobody completed leaves the tallies where they were
+        row = await memory_store.update_group(group_id, current_build={"type": "house", "days_required": 1, "days_completed": 0})
+        await memory_store.write_day_results([sweeper.rollover(row, "2026-03-07")])
+        row = await memory_store.get_group_by_id(group_id)
+        assert (row["best_streak"], row["total_days_completed"]) == (2, 1)
+
+        await memory_store.delete_group(group_id)
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+"""
+Completions around the daily reset, against the Postgres in DATABASE_URL
+(skipped without one). Each test makes its own groups and deletes them.
+"""
+import asyncio
+import os
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault("STORAGE_BACKEND", "postgres")
+
+import cache  # noqa: E402
+import database  # noqa: E402
+import main  # noqa: E402
+from game_logic import get_processing_date  # noqa: E402
+from models import CompleteGoal  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    "DATABASE_URL" not in os.environ or main.storage.BACKEND != "postgres",
+    reason="needs Postgres in DATABASE_URL",
+)
+
+
+async def _complete(group_id: str, member: str) -> dict:
+    response = await main.complete_goal(group_id, CompleteGoal(member=member))
+    return database.loads(response.body)
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_tap_after_reset_counts_for_the_new_day(monkeypatch, coalesce):
+    monkeypatch.setattr(database, "COALESCE_COMPLETIONS", coalesce)
+
+    async def run():
+        await database.init_pool()
+        group = await database.create_group("reset", "a", "run", "00:00")
+        group_id = group["group_id"]
+        try:
+            await database.add_member(group["group_code"], "b", 8)
+            await main.load_group(group_id)
+            assert (await _complete(group_id, "a"))["completions_today"] == ["a"]
+
+            # The reset passes before the sweeper or a lazy rollover gets to the group
+            await database.make_due([group_id])
+            cache.clear()
+            group = await _complete(group_id, "a")
+
+            assert group["completions_today"] == ["a"]
+            assert group["last_processed_date"] == get_processing_date("00:00")
+            row = await database.get_group_by_id(group_id)
+            assert list(row["completions_today"]) == ["a"]
+            assert row["last_processed_date"] == get_processing_date("00:00")
+        finally:
+            await database.delete_group(group_id)
+            await database.close_pool()
+
+    asyncio.run(run())